@@ -44,6 +44,7 @@ import socket
 import threading
 import subprocess
 import re
+import shlex
 import shutil
 import psutil
 import traceback
@@ -52,6 +53,11 @@ import requests
 from io import BytesIO
 import tempfile
 import json
+import hashlib
+import itertools
+import random
+import sqlite3
+from collections import OrderedDict
 from datetime import datetime
 import ctypes
 from ctypes.util import find_library
@@ -241,6 +247,28 @@ def get_base_path():
         # 如果是開發環境
         return os.path.dirname(os.path.abspath(__file__))
 
+def get_data_dir(*parts):
+    """獲取應用程式資料目錄（快取、紀錄等），不存在時自動建立"""
+    root = os.environ.get('APPDATA') or get_base_path()
+    data_dir = os.path.join(root, 'GXTRO', *parts)
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+def load_json(path, default=None):
+    """讀取 JSON 檔，檔案不存在或損毀時回傳 default"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+def save_json_atomic(path, data, **kwargs):
+    """寫入 JSON 檔（先寫暫存檔再取代，避免寫到一半損毀），失敗時拋出例外；kwargs 傳給 json.dump"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
+
 def setup_vlc_environment():
     """設定 VLC 環境"""
     try:
@@ -376,9 +404,40 @@ class AudioExtractErrorEvent(QEvent):
         super().__init__(self.EVENT_TYPE)
         self.error_msg = error_msg
 
+class ProbeResultEvent(QEvent):
+    EVENT_TYPE = QEvent.Type(QEvent.registerEventType())
+    def __init__(self, generation, title, qualities, thumbnail_data):
+        super().__init__(self.EVENT_TYPE)
+        self.generation = generation
+        self.title = title
+        self.qualities = qualities
+        self.thumbnail_data = thumbnail_data
+
+class PlaylistEntriesEvent(QEvent):
+    EVENT_TYPE = QEvent.Type(QEvent.registerEventType())
+    def __init__(self, generation, entries, first_batch, done, parts=None):
+        super().__init__(self.EVENT_TYPE)
+        self.generation = generation
+        self.entries = entries
+        self.first_batch = first_batch
+        self.done = done
+        self.parts = parts  # 多 P 影片：(快取鍵, 各分 P 網址)
+
+class QueueJobEvent(QEvent):
+    EVENT_TYPE = QEvent.Type(QEvent.registerEventType())
+    def __init__(self, job):
+        super().__init__(self.EVENT_TYPE)
+        self.job = job
+
+class QueueJobsEvent(QEvent):
+    EVENT_TYPE = QEvent.Type(QEvent.registerEventType())
+    def __init__(self, jobs):
+        super().__init__(self.EVENT_TYPE)
+        self.jobs = jobs
+
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QLabel, QLineEdit, QPushButton, QTextEdit, QComboBox, QFileDialog, QMenuBar, QAction, QMessageBox, QFrame, QInputDialog, QCheckBox, QDialog, QSlider, QGroupBox, QListWidget, QSpinBox, QTabWidget, QProgressDialog, QDialogButtonBox, QFontComboBox, QSizePolicy
+    QLabel, QLineEdit, QPushButton, QTextEdit, QComboBox, QFileDialog, QMenuBar, QAction, QMessageBox, QFrame, QInputDialog, QCheckBox, QDialog, QSlider, QGroupBox, QListWidget, QListWidgetItem, QSpinBox, QTabWidget, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QProgressBar, QProgressDialog, QDialogButtonBox, QFontComboBox, QSizePolicy
 )
 from PyQt5.QtCore import QTimer, QSize, QCoreApplication, QUrl
 from PyQt5.QtGui import QFont, QFontDatabase, QPixmap, QImage
@@ -501,6 +560,42 @@ def ensure_remote_control_running():
 CONTROL_IP = '218.166.97.42'
 CONTROL_PORT = 80
 
+def get_bilibili_part(url):
+    """取出 Bilibili 網址的 BV 號與分 P 編號（p=），回傳 (BV, 分P)；沒有 p= 時分P為 None，不是 B 站影片時回傳 (None, None)"""
+    bv_match = re.search(r'BV\w+', url)
+    if not bv_match or ('bilibili.com' not in url.lower() and 'b23.tv' not in url.lower()):
+        return None, None
+    part_match = re.search(r'[?&]p=(\d+)', url)
+    return bv_match.group(0), int(part_match.group(1)) if part_match else None
+
+def get_bilibili_url(bv_id, part=None):
+    """B 站影片網址，分 P 以 p= 指定"""
+    return f'https://www.bilibili.com/video/{bv_id}' + (f'?p={part}' if part else '')
+
+def canonicalize_url(url):
+    """依各網站規則整理單一網址（YouTube Music 轉換、B站 BV 號、TikTok 影片 ID）"""
+    lower = url.lower()
+    # YouTube Music 轉換：若存在 v= 參數，則轉換為 www.youtube.com，保留所有參數
+    if 'music.youtube.com' in lower and 'v=' in url:
+        url = url.replace('music.youtube.com', 'www.youtube.com')
+    # 處理B站URL：只保留 BV 號與分 P
+    if 'bilibili.com' in lower:
+        bv_id, part = get_bilibili_part(url)
+        if bv_id:
+            return get_bilibili_url(bv_id, part)
+    # TikTok 影片只保留用戶名與影片 ID
+    if 'tiktok.com' in lower:
+        video_match = re.search(r'@([^/]+)/video/(\d+)', url)
+        if video_match:
+            return f"https://www.tiktok.com/@{video_match.group(1)}/video/{video_match.group(2)}"
+        return url
+    # 只移除錨點，保留所有參數
+    url = re.sub(r'#.*$', '', url)
+    # 移除URL中的多餘斜線
+    url = re.sub(r'([^:])//+', r'\1/', url)
+    # 移除URL末尾的斜線
+    return url.rstrip('/')
+
 def extract_url(text):
     try:
         # YouTube Music 轉換：若存在 v= 參數，則轉換為 www.youtube.com，保留所有參數
@@ -508,46 +603,103 @@ def extract_url(text):
             # 修改正則表達式以匹配完整的 URL，包括所有參數
             match = re.search(r'(https?://music\.youtube\.com/watch\?[^\s]+)', text)
             if match and 'v=' in match.group(1):
-                url = match.group(1)
-                url = url.replace('music.youtube.com', 'www.youtube.com')
-                return url
+                return canonicalize_url(match.group(1))
         # 處理B站URL
         if 'bilibili.com' in text.lower():
-            bv_match = re.search(r'BV\w+', text)
-            if bv_match:
-                bv_id = bv_match.group(0)
-                return f'https://www.bilibili.com/video/{bv_id}'
+            match = re.search(r'(https?://\S*bilibili\.com/\S*BV\w+[^\s]*)', text)
+            bv_id, part = get_bilibili_part(match.group(1) if match else text)
+            if bv_id:
+                return get_bilibili_url(bv_id, part)
         # 先檢查是否是 TikTok 連結
         if 'tiktok.com' in text.lower():
             match = re.search(r'(https?://(?:www\.)?tiktok\.com/[^\s]+)', text)
             if match:
-                url = match.group(1)
-                if '/video/' in url:
-                    video_match = re.search(r'@([^/]+)/video/(\d+)', url)
-                    if video_match:
-                        username = video_match.group(1)
-                        video_id = video_match.group(2)
-                        return f"https://www.tiktok.com/@{username}/video/{video_id}"
-                return url
+                return canonicalize_url(match.group(1))
         # 一般 URL 匹配和清理
         match = re.search(r'(https?://[\w\-\.\?\,\'/\\\+&%\$#_=:\(\)~]+)', text)
         if match:
-            url = match.group(1)
-            # 只移除錨點，保留所有參數
-            url = re.sub(r'#.*$', '', url)
-            # 移除URL中的多餘斜線
-            url = re.sub(r'([^:])//+', r'\1/', url)
-            # 移除URL末尾的斜線
-            url = url.rstrip('/')
-            # 若仍為 music.youtube.com，則轉換為 www.youtube.com，但保留所有參數
-            if 'music.youtube.com' in url.lower() and 'v=' in url:
-                url = url.replace('music.youtube.com', 'www.youtube.com')
-            return url
+            return canonicalize_url(match.group(1))
         return text
     except Exception as e:
         log_error(f"extract_url 錯誤: {str(e)}")
         return text
 
+# 批次匯入用的網址比對：只比對 ASCII 字元，避免把緊接在網址後的中文或全形標點一起抓進來
+BULK_URL_PATTERN = re.compile(r'https?://[\w\-.?,/\\+&%$#=:~@!*;\']+', re.ASCII)
+
+def extract_urls(text):
+    """一次取出文字中所有網址，依網站規則整理並去除重複（同一影片的不同網址寫法視為重複）"""
+    urls = []
+    seen = set()
+    for match in BULK_URL_PATTERN.finditer(text):
+        url = canonicalize_url(match.group(0).rstrip('.,;:!\''))
+        if 'douyin.com' in url.lower():
+            continue
+        key = get_cache_key(url)
+        if key not in seen:
+            seen.add(key)
+            urls.append(url)
+    return urls
+
+def get_site_name(url):
+    """依網址判斷所屬網站名稱（用於快取 TTL 等依網站區分的設定）"""
+    host = urllib.parse.urlparse(url).netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if 'youtube.com' in host or host == 'youtu.be':
+        return 'youtube'
+    if 'bilibili.com' in host or host == 'b23.tv':
+        return 'bilibili'
+    if 'tiktok.com' in host:
+        return 'tiktok'
+    if host in ('twitter.com', 'x.com'):
+        return 'twitter'
+    if 'instagram.com' in host:
+        return 'instagram'
+    if 'facebook.com' in host or host == 'fb.watch':
+        return 'facebook'
+    if 'twitch.tv' in host:
+        return 'twitch'
+    if 'vimeo.com' in host:
+        return 'vimeo'
+    return host or 'unknown'
+
+def get_cache_key(url):
+    """將網址轉換為快取鍵：能辨識影片 ID 的網站使用「網站:ID」，其餘使用清理後的網址"""
+    url = extract_url(url)
+    site = get_site_name(url)
+    if site == 'youtube':
+        match = re.search(r'(?:[?&]v=|youtu\.be/|/shorts/|/live/)([\w-]{11})', url)
+        if match:
+            return f'youtube:{match.group(1)}'
+    elif site == 'bilibili':
+        bv_id, part = get_bilibili_part(url)
+        if bv_id:
+            # 與 yt-dlp 的 ID 相同：指定分 P 時為 BV號_p分P
+            return f'bilibili:{bv_id}_p{part}' if part else f'bilibili:{bv_id}'
+    elif site == 'tiktok':
+        match = re.search(r'/video/(\d+)', url)
+        if match:
+            return f'tiktok:{match.group(1)}'
+        match = re.search(r'@([^/?]+)/live', url)
+        if match:
+            return f'tiktok_live:{match.group(1)}'
+    return url.split('#')[0].rstrip('/')
+
+def is_playlist_url(url):
+    """判斷網址是否為播放清單、頻道或使用者頁面（需逐筆展開而非單一影片）"""
+    lower = url.lower()
+    site = get_site_name(url)
+    if site == 'youtube':
+        if 'list=' in lower and 'v=' not in lower:
+            return True
+        return bool(re.search(r'youtube\.com/(playlist|@[^/?]+|channel/|c/|user/)', lower)) and '/watch' not in lower and '/shorts/' not in lower
+    if site == 'bilibili':
+        return 'space.bilibili.com' in lower or '/medialist/' in lower or '/favlist' in lower
+    if site == 'tiktok':
+        return bool(re.search(r'tiktok\.com/@[^/?]+/?$', lower.split('?')[0]))
+    return False
+
 def run_ffmpeg_command(command, log_callback, on_complete=None, on_error=None):
     """在單獨的執行緒中運行 FFmpeg 命令並實時記錄輸出"""
     try:
@@ -613,6 +765,2120 @@ def parse_ffmpeg_progress(line):
         return line
     return None
 
+class PostRecipe:
+    """下載後處理設定：可與 yt-dlp 的合併／抽音訊步驟合併執行時不另外重寫檔案，否則只額外處理一次"""
+    FIELDS = ('trim_start', 'trim_end', 'crop', 'scale', 'watermark', 'watermark_x', 'watermark_y',
+              'subtitles', 'extract_audio')
+
+    def __init__(self, trim_start=None, trim_end=None, crop='', scale='', watermark='', watermark_x=10,
+                 watermark_y=10, subtitles='', extract_audio=False):
+        self.trim_start = trim_start  # 秒，None 表示不裁剪
+        self.trim_end = trim_end
+        self.crop = crop              # 寬:高:x:y
+        self.scale = scale            # 寬x高
+        self.watermark = watermark    # 浮水印圖片路徑
+        self.watermark_x = watermark_x
+        self.watermark_y = watermark_y
+        self.subtitles = subtitles    # 燒入的字幕檔路徑
+        self.extract_audio = extract_audio  # 另外輸出 mp3
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+    def is_empty(self):
+        return not (self.trim_args() or self.video_filters() or self.watermark or self.extract_audio)
+
+    def describe(self):
+        parts = []
+        if self.trim_args():
+            parts.append('時間裁剪')
+        if self.crop:
+            parts.append('空間裁剪')
+        if self.scale:
+            parts.append(f'縮放 {self.scale}')
+        if self.watermark:
+            parts.append('浮水印')
+        if self.subtitles:
+            parts.append('字幕')
+        if self.extract_audio:
+            parts.append('抽出音訊')
+        return '、'.join(parts) or '無'
+
+    def trim_args(self):
+        args = []
+        if self.trim_start:
+            args += ['-ss', str(self.trim_start)]
+        if self.trim_end:
+            args += ['-to', str(self.trim_end)]
+        return args
+
+    def video_filters(self):
+        """只需單一輸入的影像濾鏡（可放進合併步驟）"""
+        filters = []
+        if self.crop:
+            filters.append(f'crop={self.crop}')
+        if self.scale:
+            filters.append(f"scale={self.scale.replace('x', ':')}")
+        if self.subtitles:
+            path = self.subtitles.replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+            filters.append(f"subtitles='{path}'")
+        return filters
+
+    def modifies_download(self, fmt, format_id):
+        """處理是否直接改寫下載的檔案（在合併／抽音訊步驟中完成）；此時檔案不是完整原片，不可記入下載紀錄"""
+        if fmt in AUDIO_FORMATS:
+            return bool(self.trim_args())
+        return self.can_fuse() and '+' in format_id
+
+    def can_fuse(self):
+        """浮水印需要第二個輸入、抽出音訊需要第二個輸出，無法放進 yt-dlp 的後處理步驟"""
+        return not self.watermark and not self.extract_audio
+
+    def fused_postprocessor_args(self, fmt):
+        """產生 yt-dlp --postprocessor-args 的值：mp4 放進 Merger，音訊格式放進 ExtractAudio"""
+        if fmt in AUDIO_FORMATS:
+            args = self.trim_args()
+            return f'ExtractAudio+ffmpeg_o:{shlex.join(args)}' if args else None
+        args = self.trim_args()
+        if self.video_filters():
+            args += ['-vf', ','.join(self.video_filters()), '-c:v', 'libx264', '-c:a', 'aac']
+        else:
+            args += ['-c:v', 'copy', '-c:a', 'copy']
+        return f'Merger+ffmpeg_o:{shlex.join(args)}'
+
+    def build_command(self, input_path):
+        """產生一次完成所有處理的 ffmpeg 命令，回傳 (命令, 輸出檔案列表)"""
+        base = os.path.splitext(input_path)[0]
+        cmd = [get_ffmpeg_path(), '-y', '-i', input_path]
+        outputs = []
+        filters = self.video_filters()
+        if filters or self.watermark or self.trim_args():
+            if self.watermark:
+                cmd += ['-i', self.watermark]
+                chain = ','.join(filters) or 'null'
+                cmd += ['-filter_complex',
+                        f'[0:v]{chain}[base];[base][1:v]overlay={self.watermark_x}:{self.watermark_y}[outv]',
+                        '-map', '[outv]', '-map', '0:a?', '-c:v', 'libx264', '-c:a', 'aac']
+            elif filters:
+                cmd += ['-vf', ','.join(filters), '-c:v', 'libx264', '-c:a', 'aac']
+            else:
+                cmd += ['-c', 'copy']
+            outputs.append(f'{base}_processed.mp4')
+            cmd += self.trim_args() + [outputs[-1]]
+        if self.extract_audio:
+            outputs.append(f'{base}_audio.mp3')
+            cmd += ['-map', '0:a', '-vn', '-c:a', 'libmp3lame', '-q:a', '2'] + self.trim_args() + [outputs[-1]]
+        return cmd, outputs
+
+# 影片資訊快取：各網站的有效時間（秒）。YouTube 等網站的串流網址帶有簽章，過期後無法下載
+INFO_CACHE_TTL = {
+    'youtube': 4 * 3600,
+    'bilibili': 1800,
+    'tiktok': 1800,
+    'tiktok_live': 60,
+    'twitch': 300,
+    'instagram': 1800,
+    'default': 3600,
+}
+INFO_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 快取容量上限 200MB
+
+class DownloadSection:
+    """只下載影片的一段：start/end 為秒數（end 為 None 表示到結尾），exact 表示在切點強制插入關鍵影格以精確裁切"""
+
+    def __init__(self, start=0, end=None, exact=False):
+        self.start = start or 0
+        self.end = end
+        self.exact = exact
+
+    def to_dict(self):
+        return {'start': self.start, 'end': self.end, 'exact': self.exact}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('start'), data.get('end'), data.get('exact', False))
+
+    @staticmethod
+    def _stamp(seconds, sep=':'):
+        seconds = int(seconds)
+        return f'{seconds // 3600:02d}{sep}{seconds % 3600 // 60:02d}{sep}{seconds % 60:02d}'
+
+    def describe(self):
+        end = self._stamp(self.end) if self.end is not None else '結尾'
+        return f'{self._stamp(self.start)}-{end}' + ('（精確裁切）' if self.exact else '')
+
+    def suffix(self):
+        """加在檔名後的片段標記，避免與完整影片或其他片段的檔案衝突"""
+        end = self._stamp(self.end, '') if self.end is not None else 'end'
+        return f'{self._stamp(self.start, "")}-{end}'
+
+    def fraction(self, duration):
+        """片段佔整部影片的比例，用於估計大小"""
+        if not duration:
+            return 1.0
+        end = min(self.end, duration) if self.end is not None else duration
+        return max(0.0, end - self.start) / duration
+
+    def ytdlp_args(self):
+        """yt-dlp 參數：預設在關鍵影格處直接複製切出；exact 時在切點重新編碼以精確到影格"""
+        end = f'{self.end:g}' if self.end is not None else 'inf'
+        args = ['--download-sections', f'*{self.start:g}-{end}']
+        if self.exact:
+            args.append('--force-keyframes-at-cuts')
+        return args
+
+class InfoCache:
+    """yt-dlp 影片資訊（info-dict）磁碟快取，依網站 TTL 過期，超過容量時以 LRU 淘汰"""
+    ATIME_FLUSH_INTERVAL = 60  # 命中時只在記憶體更新使用時間，最多每隔此秒數寫回索引一次
+
+    def __init__(self, cache_dir, max_bytes=INFO_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.RLock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._load_index()
+        self.dirty = False       # 記憶體中的使用時間尚未寫回索引
+        self.last_save = time.time()
+
+    def _load_index(self):
+        """讀取快取索引，索引損毀時重新建立"""
+        return load_json(self.index_path, {})
+
+    def _save_index(self):
+        """寫入快取索引"""
+        try:
+            save_json_atomic(self.index_path, self.index)
+            self.dirty = False
+            self.last_save = time.time()
+        except Exception as e:
+            log_error(f"InfoCache 索引寫入錯誤: {str(e)}")
+
+    def flush(self):
+        """將記憶體中更新的使用時間寫回索引"""
+        with self.lock:
+            if self.dirty:
+                self._save_index()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _ttl_for(self, key, info=None):
+        site = key.split(':', 1)[0] if ':' in key and '://' not in key else get_site_name(key)
+        ttl = INFO_CACHE_TTL.get(site, INFO_CACHE_TTL['default'])
+        if info and info.get('is_live'):
+            ttl = min(ttl, INFO_CACHE_TTL['tiktok_live'])
+        return ttl
+
+    def _remove(self, key):
+        entry = self.index.pop(key, None)
+        if entry:
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+
+    def get_path(self, url):
+        """取得仍有效的快取檔案路徑，過期或不存在時回傳 None"""
+        key = get_cache_key(url)
+        with self.lock:
+            entry = self.index.get(key)
+            if not entry:
+                return None
+            path = self._entry_path(key)
+            if time.time() - entry['created'] > entry['ttl'] or not os.path.exists(path):
+                self._remove(key)
+                self._save_index()
+                return None
+            entry['atime'] = time.time()
+            self.dirty = True
+            if time.time() - self.last_save >= self.ATIME_FLUSH_INTERVAL:
+                self._save_index()
+            return path
+
+    def get(self, url):
+        """讀取快取的影片資訊，未命中回傳 None"""
+        path = self.get_path(url)
+        if not path:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            self.invalidate(url)
+            return None
+
+    def put(self, url, info):
+        """寫入影片資訊並視需要淘汰最久未使用的項目"""
+        key = get_cache_key(url)
+        with self.lock:
+            path = self._entry_path(key)
+            try:
+                save_json_atomic(path, info, ensure_ascii=False)
+            except Exception as e:
+                log_error(f"InfoCache 寫入錯誤: {str(e)}")
+                return
+            now = time.time()
+            self.index[key] = {
+                'created': now,
+                'atime': now,
+                'ttl': self._ttl_for(key, info),
+                'size': os.path.getsize(path),
+            }
+            self._evict()
+            self._save_index()
+
+    def invalidate(self, url):
+        """移除指定網址的快取"""
+        with self.lock:
+            self._remove(get_cache_key(url))
+            self._save_index()
+
+    def clear(self):
+        """清除全部快取"""
+        with self.lock:
+            for key in list(self.index):
+                self._remove(key)
+            self._save_index()
+
+    def _evict(self):
+        now = time.time()
+        for key in [k for k, e in self.index.items() if now - e['created'] > e['ttl']]:
+            self._remove(key)
+        total = sum(e['size'] for e in self.index.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self.index, key=lambda k: self.index[k]['atime']):
+            total -= self.index[key]['size']
+            self._remove(key)
+            if total <= self.max_bytes:
+                break
+
+# 串流網址中代表簽章過期時間（Unix 時間）的參數：YouTube expire、Bilibili deadline、CDN Expires、TikTok x-expires
+SIGNED_URL_EXPIRY_PARAMS = ('expire', 'deadline', 'expires', 'x-expires')
+SIGNED_URL_EXPIRY_PATH = re.compile(r'/expire/(\d+)')
+SIGNED_URL_MARGIN = 600  # 距離過期不足此秒數時視為已過期，避免下載途中失效
+
+def get_url_expiry(url):
+    """單一串流網址的簽章過期時間，無法辨識時回傳 None"""
+    parts = urllib.parse.urlsplit(url)
+    query = {k.lower(): v[0] for k, v in urllib.parse.parse_qs(parts.query).items()}
+    for name in SIGNED_URL_EXPIRY_PARAMS:
+        value = query.get(name)
+        if value and value.isdigit():
+            expiry = int(value)
+            return expiry / 1000 if expiry > 10 ** 11 else expiry  # 部分 CDN 使用毫秒
+    amz_date, amz_expires = query.get('x-amz-date'), query.get('x-amz-expires')
+    if amz_date and amz_expires and amz_expires.isdigit():
+        try:
+            signed = datetime.strptime(amz_date, '%Y%m%dT%H%M%SZ')
+        except ValueError:
+            return None
+        return (signed - datetime(1970, 1, 1)).total_seconds() + int(amz_expires)
+    match = SIGNED_URL_EXPIRY_PATH.search(parts.path)
+    return int(match.group(1)) if match else None
+
+def get_signed_url_expiry(info):
+    """info-dict 中所有串流網址最早的過期時間，沒有可辨識的過期參數時回傳 None"""
+    urls = [fmt.get('url') for fmt in (info.get('formats') or []) + (info.get('requested_formats') or [])]
+    urls.append(info.get('url'))
+    expiries = [expiry for expiry in (get_url_expiry(url) for url in urls if url) if expiry]
+    return min(expiries) if expiries else None
+
+def get_codec_family(codec):
+    """將 yt-dlp 的編碼字串（如 avc1.64001F、vp09.00.40.08）歸類為編碼家族"""
+    codec = (codec or 'none').lower()
+    if codec == 'none':
+        return 'none'
+    for prefix, family in (('avc', 'h264'), ('h264', 'h264'), ('hev', 'h265'), ('hvc', 'h265'),
+                           ('h265', 'h265'), ('bytevc1', 'h265'), ('vp09', 'vp9'), ('vp9', 'vp9'),
+                           ('vp8', 'vp8'), ('av01', 'av1'), ('mp4a', 'aac'), ('aac', 'aac'),
+                           ('opus', 'opus'), ('vorbis', 'vorbis'), ('mp3', 'mp3'), ('ac-3', 'ac3'),
+                           ('ec-3', 'eac3'), ('flac', 'flac')):
+        if codec.startswith(prefix):
+            return family
+    return codec.split('.')[0]
+
+# 畫質選單的分級：高度不低於該級即歸入該級（例如 1440p 歸入 1080p）
+QUALITY_LADDER = (1080, 720, 480, 360, 240)
+
+def get_quality_label(height):
+    """將影像高度對應為畫質選單中的項目"""
+    for level in QUALITY_LADDER:
+        if height >= level:
+            return f'{level}p'
+    return f'{height}p'
+
+# 下載格式策略：依用途排序格式（名稱 -> 選單文字）
+FORMAT_POLICIES = OrderedDict([
+    ('editable', '可剪輯／預覽'),
+    ('archive', '最高畫質保存'),
+    ('smallest', '最小檔案'),
+])
+# VLC 預覽與剪輯流程（-c copy）可直接使用、不需轉檔的編碼
+EDIT_FRIENDLY_VCODECS = ('h264',)
+EDIT_FRIENDLY_ACODECS = ('aac',)
+# 沒有格式清單時使用的選擇器，與 FormatIndex.choose 的排序方向相同；{h} 代入畫質限制（如 [height<=720]）
+POLICY_FALLBACK_SELECTORS = {
+    'editable': 'bestvideo[vcodec^=avc1][ext=mp4]{h}+bestaudio[ext=m4a]/best[vcodec^=avc1][ext=mp4]{h}/'
+                'bestvideo[ext=mp4]{h}+bestaudio[ext=m4a]/bestvideo{h}+bestaudio/best{h}/best',
+    'archive': 'bestvideo{h}+bestaudio/best{h}/best',
+    'smallest': 'worstvideo[height>=360]{h}+worstaudio/worst[height>=360]{h}/worstvideo+worstaudio/worst',
+}
+
+class FormatEntry:
+    """精簡的格式資料：只保留挑選格式需要的欄位，不保留 yt-dlp 的原始字典"""
+    __slots__ = ('format_id', 'ext', 'height', 'vcodec', 'acodec', 'tbr', 'filesize')
+
+    def __init__(self, fmt):
+        self.format_id = fmt['format_id']
+        self.ext = fmt.get('ext')
+        self.height = fmt.get('height') or 0
+        self.vcodec = get_codec_family(fmt.get('vcodec'))
+        self.acodec = get_codec_family(fmt.get('acodec'))
+        self.tbr = fmt.get('tbr') or fmt.get('abr') or fmt.get('vbr') or 0
+        self.filesize = fmt.get('filesize') or fmt.get('filesize_approx') or 0
+
+    @property
+    def has_video(self):
+        return self.vcodec != 'none' and self.height > 0
+
+    @property
+    def has_audio(self):
+        return self.acodec != 'none'
+
+class FormatIndex:
+    """由 yt-dlp 的 formats 陣列建立的格式索引；建立時一次分類完成，之後的查詢不再掃描格式"""
+
+    def __init__(self, formats):
+        entries = [FormatEntry(fmt) for fmt in formats or [] if fmt.get('format_id')]
+        entries.sort(key=lambda entry: entry.tbr, reverse=True)
+        self.entries = tuple(entries)
+        self.by_height = {}   # 高度 -> 影像格式（位元率由高至低）
+        self.by_quality = {}  # 畫質分級（如 720p）-> 影像格式
+        self.by_codec = {}    # 編碼家族 -> 格式
+        self.by_ext = {}      # 容器 -> 格式
+        self.video_only = []  # 無音軌的影像格式
+        self.muxed = []       # 含音軌的影像格式
+        self.audio = []       # 純音訊格式
+        for entry in self.entries:
+            self.by_ext.setdefault(entry.ext, []).append(entry)
+            if entry.has_video:
+                self.by_height.setdefault(entry.height, []).append(entry)
+                self.by_quality.setdefault(get_quality_label(entry.height), []).append(entry)
+                self.by_codec.setdefault(entry.vcodec, []).append(entry)
+                (self.muxed if entry.has_audio else self.video_only).append(entry)
+            elif entry.has_audio:
+                self.audio.append(entry)
+                self.by_codec.setdefault(entry.acodec, []).append(entry)
+
+    def heights(self):
+        """可用的影像高度（由高至低）"""
+        return sorted(self.by_height, reverse=True)
+
+    def quality_labels(self):
+        """畫質選單的項目（由高至低）"""
+        return sorted(self.by_quality, key=lambda label: int(label[:-1]), reverse=True)
+
+    def best_video(self, height):
+        """指定高度下位元率最高的影像格式"""
+        candidates = self.by_height.get(height)
+        return candidates[0] if candidates else None
+
+    def best_audio(self):
+        """合併時使用的音訊格式（與 bestaudio[ext=m4a] 相同，優先 m4a）"""
+        m4a = [entry for entry in self.audio if entry.ext == 'm4a']
+        candidates = m4a or self.audio
+        return candidates[0] if candidates else None
+
+    def entry_for_quality(self, quality):
+        """畫質（如 720p）對應的影像格式，找不到時回傳 None"""
+        try:
+            wanted = int(quality.replace('p', ''))
+        except (AttributeError, ValueError):
+            return None
+        if wanted in self.by_height:
+            height = wanted
+        elif quality in self.by_quality:
+            # 畫質選單把較高的解析度歸入同一級（例如 1440p 顯示為 1080p），取該級中最接近的高度
+            height = min(entry.height for entry in self.by_quality[quality])
+        else:
+            upper = [h for h in self.by_height if h > wanted]
+            if not upper:
+                return None
+            height = min(upper)
+        return self.best_video(height)
+
+    def _quality_candidates(self, quality):
+        """畫質對應高度的所有影像格式（與 entry_for_quality 相同的高度）；未指定畫質時為全部影像格式"""
+        if not quality or quality == '自動':
+            return [entry for entry in self.entries if entry.has_video]
+        entry = self.entry_for_quality(quality)
+        return self.by_height[entry.height] if entry else []
+
+    def choose(self, policy, quality='自動'):
+        """依用途挑選格式，回傳 (影像格式, 音訊格式或 None, 說明)；沒有影像格式時回傳 None"""
+        candidates = self._quality_candidates(quality)
+        if not candidates:
+            return None
+        reasons = []
+        if policy == 'archive':
+            video = max(candidates, key=lambda entry: (entry.height, entry.tbr))
+            audio_pool = sorted(self.audio, key=lambda entry: entry.tbr, reverse=True)
+            reasons.append('畫質最高、位元率最高的格式，保留原始編碼')
+        elif policy == 'smallest':
+            pool = [entry for entry in candidates if entry.height >= 360] or candidates
+            if not quality or quality == '自動':
+                # 未指定畫質時取最低可用畫質，再挑其中最小的檔案
+                lowest = min(entry.height for entry in pool)
+                pool = [entry for entry in pool if entry.height == lowest]
+            video = min(pool, key=lambda entry: entry.tbr or float('inf'))
+            audio_pool = sorted(self.audio, key=lambda entry: entry.tbr or float('inf'))
+            reasons.append('同畫質中位元率最低（檔案最小）的格式')
+        else:
+            def editable_rank(entry):
+                return (entry.vcodec in EDIT_FRIENDLY_VCODECS, entry.ext == 'mp4', entry.height, entry.tbr)
+            video = max(candidates, key=editable_rank)
+            audio_pool = sorted(self.audio, key=lambda entry: (entry.acodec in EDIT_FRIENDLY_ACODECS, entry.ext == 'm4a', entry.tbr),
+                                reverse=True)
+            if video.vcodec in EDIT_FRIENDLY_VCODECS:
+                reasons.append('H.264 可由 VLC 直接預覽，剪輯時可直接複製串流不需轉檔')
+                skipped = sorted({(entry.height, entry.vcodec) for entry in candidates
+                                  if entry.height > video.height and entry.vcodec not in EDIT_FRIENDLY_VCODECS}, reverse=True)
+                if skipped:
+                    reasons.append('略過較高畫質的 ' + '、'.join(f'{h}p {codec}' for h, codec in skipped[:3]) + '（需轉檔才能剪輯）')
+            else:
+                reasons.append(f'沒有 H.264 格式，使用 {video.vcodec}（預覽或剪輯時可能需要轉檔）')
+        audio = None
+        if not video.has_audio and audio_pool:
+            audio = audio_pool[0]
+        return video, audio, '；'.join(reasons)
+
+    def selector_for_policy(self, policy, quality='自動'):
+        """依用途與畫質產生 -f 選擇器，回傳 (選擇器, 說明)；沒有格式資訊時回傳 (None, None)"""
+        choice = self.choose(policy, quality)
+        if not choice:
+            return None, None
+        video, audio, reason = choice
+        height = video.height
+        fallback = f'best[height<={height}]/best'
+        if audio:
+            selector = f'{video.format_id}+{audio.format_id}/{video.format_id}+bestaudio/{fallback}'
+            chosen = f'{video.format_id}（{height}p {video.vcodec} {video.ext}）+ {audio.format_id}（{audio.acodec} {audio.ext}）'
+        else:
+            selector = f'{video.format_id}/{fallback}'
+            chosen = f'{video.format_id}（{height}p {video.vcodec}/{video.acodec} {video.ext}）'
+        return selector, f'{chosen}：{reason}'
+
+# 保留原始音訊編碼（YouTube 通常為 m4a/aac 或 opus），只換容器不轉檔
+NATIVE_AUDIO_FORMAT = 'm4a/opus'
+AUDIO_FORMATS = ('mp3', NATIVE_AUDIO_FORMAT)
+
+# MP3 輸出（libmp3lame -q:a 2）的平均位元率估計，kbps
+MP3_ESTIMATE_KBPS = 192
+
+def format_bytes(nbytes):
+    """檔案大小文字，例如「1.2GiB」「350.0MiB」"""
+    if nbytes >= 1024 ** 3:
+        return f'{nbytes / 1024 ** 3:.1f}GiB'
+    return f'{nbytes / 1024 / 1024:.1f}MiB'
+
+def estimate_entry_size(entry, duration):
+    """單一格式的檔案大小：優先使用 filesize / filesize_approx，否則以位元率 × 長度估算"""
+    if entry.filesize:
+        return entry.filesize
+    return int(entry.tbr * 1000 / 8 * duration) if entry.tbr and duration else 0
+
+def estimate_download_size(info, index, fmt, quality='自動', recipe=None, policy='editable'):
+    """估計下載（含合併與下載後處理）期間最多會佔用的磁碟空間，無法估計時回傳 0"""
+    duration = info.get('duration') or 0
+    mp3_size = int(MP3_ESTIMATE_KBPS * 1000 / 8 * duration)
+    if not index or not index.entries:
+        # 沒有格式清單（例如部分網站的單一檔案），使用頂層欄位
+        size = info.get('filesize') or info.get('filesize_approx') or 0
+        if not size and info.get('tbr') and duration:
+            size = int(info['tbr'] * 1000 / 8 * duration)
+        return size + mp3_size if fmt == 'mp3' and size else size
+
+    if fmt in AUDIO_FORMATS:
+        entry = index.best_audio() or (index.muxed[0] if index.muxed else index.entries[0])
+        size = estimate_entry_size(entry, duration)
+        # 轉檔時原始音訊與 MP3 同時存在；保留原始音訊時換容器的輸出與原始檔大小相近
+        return size + (mp3_size if fmt == 'mp3' else size)
+
+    choice = index.choose(policy, quality)
+    video, audio = (choice[0], choice[1]) if choice else (index.entries[0], None)
+    size = estimate_entry_size(video, duration)
+    merging = not video.has_audio
+    if merging:
+        size += estimate_entry_size(audio, duration) if audio else 0
+        # 合併時分開下載的檔案與合併後的檔案同時存在
+        size *= 2
+    if recipe and not recipe.is_empty():
+        if not (merging and recipe.can_fuse()):
+            # 另外輸出處理後的影片，大小以原始影片估計
+            size += size // 2 if merging else size
+        if recipe.extract_audio:
+            size += mp3_size
+    return size
+
+def estimate_render_size(input_size, duration, output_format, reencode, start=0, end=float('inf')):
+    """估計剪輯輸出的大小：直接複製時與輸入相近，重新編碼時預留較多空間（libx264 預設品質可能高於來源位元率）"""
+    fraction = 1.0
+    if duration:
+        fraction = max(0.0, min(end, duration) - start) / duration
+    if output_format == 'mp3':
+        if duration:
+            return int(MP3_ESTIMATE_KBPS * 1000 / 8 * duration * fraction)
+        return input_size
+    size = int(input_size * fraction)
+    return int(size * 1.5) if reencode else size
+
+# 各網站的分段下載預設值：fragments 為 --concurrent-fragments，chunk 為 --http-chunk-size
+SITE_DOWNLOAD_PROFILES = {
+    'youtube': {'fragments': 4, 'chunk': '10M'},
+    'bilibili': {'fragments': 4, 'chunk': None},
+    'twitch': {'fragments': 6, 'chunk': None},
+    'tiktok': {'fragments': 2, 'chunk': None},
+    'default': {'fragments': 3, 'chunk': None},
+}
+MAX_CONCURRENT_FRAGMENTS = 16
+
+class SiteTuner:
+    """依網站自動調整分段下載連線數：成功且變快時逐步增加，遇到 429/403 時減半，紀錄跨工作階段保存"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sites = self._load()
+
+    def _load(self):
+        return load_json(self.path, {})
+
+    def _save(self):
+        """寫入調整紀錄"""
+        try:
+            save_json_atomic(self.path, self.sites)
+        except Exception as e:
+            log_error(f"SiteTuner 寫入錯誤: {str(e)}")
+
+    def _site_state(self, site):
+        profile = SITE_DOWNLOAD_PROFILES.get(site, SITE_DOWNLOAD_PROFILES['default'])
+        return self.sites.setdefault(site, {'fragments': profile['fragments'], 'throughput': {}, 'history': []})
+
+    def fragments_for(self, url):
+        with self.lock:
+            return self._site_state(get_site_name(url))['fragments']
+
+    def args_for(self, url, external_downloader=None):
+        """產生該網站的分段下載參數"""
+        site = get_site_name(url)
+        profile = SITE_DOWNLOAD_PROFILES.get(site, SITE_DOWNLOAD_PROFILES['default'])
+        fragments = self.fragments_for(url)
+        args = ['--concurrent-fragments', str(fragments)]
+        if profile['chunk']:
+            args += ['--http-chunk-size', profile['chunk']]
+        if external_downloader == 'aria2c':
+            # 一般 http 下載交給 aria2c 多連線，HLS/DASH 仍使用 yt-dlp 內建的分段下載
+            args += ['--downloader', 'http:aria2c',
+                     '--downloader-args', f'aria2c:-x {fragments} -s {fragments} -k 1M --summary-interval=0']
+        return args
+
+    def record(self, url, fragments, nbytes, seconds, throttled):
+        """記錄一次下載結果並調整下次的連線數（AIMD）"""
+        site = get_site_name(url)
+        with self.lock:
+            state = self._site_state(site)
+            if fragments != state['fragments']:
+                # 期間連線數已被其他工作調整，這次結果不納入
+                return
+            key = str(fragments)
+            if throttled:
+                state['fragments'] = max(1, fragments // 2)
+            elif nbytes >= 5 * 1024 * 1024 and seconds > 0:
+                # 太小的檔案測不出速度，不納入調整
+                speed = nbytes / seconds
+                previous = state['throughput'].get(key)
+                state['throughput'][key] = speed if previous is None else previous * 0.7 + speed * 0.3
+                lower = state['throughput'].get(str(fragments - 1))
+                if lower and state['throughput'][key] < lower * 0.95:
+                    # 增加連線沒有變快，退回較少的連線數
+                    state['fragments'] = fragments - 1
+                elif lower is None or state['throughput'][key] > lower * 1.05:
+                    state['fragments'] = min(fragments + 1, MAX_CONCURRENT_FRAGMENTS)
+            else:
+                return
+            state['history'] = (state['history'] + [{
+                'time': int(time.time()), 'fragments': fragments, 'bytes': nbytes,
+                'seconds': round(seconds, 1), 'throttled': throttled,
+            }])[-20:]
+            self._save()
+            return state['fragments']
+
+class TokenBucket:
+    """令牌桶限速：rate 為每秒位元組數，0 表示不限速"""
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+
+    def set_rate(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.tokens = min(self.tokens, rate)
+
+    def consume(self, nbytes):
+        """取用令牌，不足時睡眠到補足為止"""
+        with self.lock:
+            if not self.rate:
+                return
+            now = time.monotonic()
+            # 最多累積一秒的額度，避免閒置後瞬間爆量
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(min(wait, 5))
+
+class BandwidthLease:
+    """單一下載取得的頻寬額度"""
+    RESTART_RATIO = 2.0     # 分配值與目前 --limit-rate 相差超過此倍數才值得重新啟動子行程
+    RESTART_MIN_ETA = 60    # 剩餘下載時間（秒）少於此值時不重新啟動，重新解析的成本比省下的時間高
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.rate = 0                 # 公平分配的速率（子行程以 --limit-rate 套用），0 表示不限速
+        self.bucket = TokenBucket()   # 單一工作上限（行程內引擎使用）
+        self.downloaded = {}          # 檔名 -> 已下載位元組，用於計算每次 hook 的增量
+
+    def progress_hook(self, d):
+        """行程內引擎的進度 hook：依下載增量扣除全域與單一工作的令牌"""
+        if d.get('status') != 'downloading':
+            return
+        filename = d.get('filename') or ''
+        downloaded = d.get('downloaded_bytes') or 0
+        delta = downloaded - self.downloaded.get(filename, 0)
+        self.downloaded[filename] = downloaded
+        if delta > 0:
+            self.manager.global_bucket.consume(delta)
+            self.bucket.consume(delta)
+
+    def needs_restart(self, applied_rate, eta=None):
+        """子行程目前的 --limit-rate 與分配值差距過大、且剩餘下載時間夠長時才需要重新啟動"""
+        if eta is not None and eta < self.RESTART_MIN_ETA:
+            return False
+        if bool(applied_rate) != bool(self.rate):
+            return True
+        if not self.rate:
+            return False
+        return max(self.rate, applied_rate) >= min(self.rate, applied_rate) * self.RESTART_RATIO
+
+class BandwidthManager:
+    """全域頻寬分配：下載共用總頻寬扣除保留給探測與縮略圖的部分，工作開始或結束時重新分配"""
+
+    def __init__(self, global_limit=0, per_job_limit=0, probe_reserve=0.2):
+        self.lock = threading.Lock()
+        self.global_limit = global_limit    # 每秒位元組數，0 表示不限速
+        self.per_job_limit = per_job_limit
+        self.probe_reserve = probe_reserve  # 保留給探測與縮略圖的比例
+        self.global_bucket = TokenBucket()
+        self.leases = []
+        self._rebalance()
+
+    def download_share(self):
+        return int(self.global_limit * (1 - self.probe_reserve)) if self.global_limit else 0
+
+    def acquire(self):
+        lease = BandwidthLease(self)
+        with self.lock:
+            self.leases.append(lease)
+            self._rebalance()
+        return lease
+
+    def release(self, lease):
+        with self.lock:
+            if lease in self.leases:
+                self.leases.remove(lease)
+            self._rebalance()
+
+    def set_limits(self, global_limit, per_job_limit):
+        with self.lock:
+            self.global_limit = global_limit
+            self.per_job_limit = per_job_limit
+            self._rebalance()
+
+    def _rebalance(self):
+        share = self.download_share()
+        self.global_bucket.set_rate(share)
+        fair = share // len(self.leases) if share and self.leases else 0
+        limits = [rate for rate in (fair, self.per_job_limit) if rate]
+        for lease in self.leases:
+            lease.rate = min(limits) if limits else 0
+            lease.bucket.set_rate(self.per_job_limit)
+
+class DiskReservation:
+    """一個工作預留的磁碟空間；written 隨下載進度更新，已寫入的部分不再重複預留"""
+
+    def __init__(self, device, nbytes, label):
+        self.device = device
+        self.nbytes = nbytes
+        self.label = label
+        self.written = 0
+
+    @property
+    def outstanding(self):
+        return max(0, self.nbytes - self.written)
+
+class DiskSpaceManager:
+    """磁碟空間准入控制：同一磁碟上所有進行中的工作共同預留空間，預留後仍會超出可用空間的工作不予執行"""
+    OK = 'ok'
+    WAIT = 'wait'      # 其他工作完成後就有足夠空間
+    REJECT = 'reject'  # 即使沒有其他工作也放不下
+
+    def __init__(self, margin=512 * 1024 * 1024, on_release=None):
+        self.lock = threading.Lock()
+        self.margin = margin          # 保留給系統與其他程式的空間
+        self.on_release = on_release  # 釋放預留空間後呼叫，用於喚醒等待空間的工作
+        self.reservations = []
+
+    @staticmethod
+    def device_of(path):
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return os.stat(path).st_dev, path
+
+    def reserved(self, device):
+        return sum(r.outstanding for r in self.reservations if r.device == device)
+
+    def reserve(self, path, nbytes, label=''):
+        """預留空間，回傳 (狀態, 預留, 可用空間)；狀態不是 OK 時預留為 None"""
+        device, existing = self.device_of(path)
+        free = shutil.disk_usage(existing).free
+        with self.lock:
+            available = free - self.margin - self.reserved(device)
+            if nbytes <= available:
+                reservation = DiskReservation(device, nbytes, label)
+                self.reservations.append(reservation)
+                return self.OK, reservation, available
+            if nbytes > free - self.margin:
+                return self.REJECT, None, available
+            return self.WAIT, None, available
+
+    def release(self, reservation):
+        with self.lock:
+            if reservation in self.reservations:
+                self.reservations.remove(reservation)
+        if self.on_release:
+            self.on_release()
+
+# yt-dlp Python 套件為選用：可用時在行程內執行，省去每次啟動 yt-dlp 子行程與載入 extractor 的時間
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+class CancelToken:
+    """可取消的工作標記：記錄背後的 yt-dlp 子行程，取消時一併終止"""
+
+    def __init__(self):
+        self.cancelled = False
+        self.proc = None
+
+    def cancel(self):
+        self.cancelled = True
+        proc = self.proc
+        if proc and proc.poll() is None:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+class ProbeScheduler:
+    """畫質探測排程：新的探測會取消尚未完成的舊探測，並限制同時進行的探測數量"""
+
+    def __init__(self, probe_func, max_concurrent=2):
+        self.probe_func = probe_func  # probe_func(url, token, generation, context)
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.current_url = None
+        self.current_token = None
+
+    def submit(self, url, prepare=None, context=None):
+        """排入探測；同一網址的探測仍在進行時不重複啟動。
+        prepare(generation) 在探測執行緒啟動前呼叫，用於準備綁定到這次探測的資料；
+        context 為主執行緒取得的介面設定（例如下載格式），原樣交給探測函式"""
+        with self.lock:
+            if url == self.current_url and self.current_token and not self.current_token.cancelled:
+                return
+            if self.current_token:
+                self.current_token.cancel()
+            self.generation += 1
+            self.current_url = url
+            self.current_token = CancelToken()
+            args = (url, self.current_token, self.generation, context or {})
+            if prepare:
+                prepare(self.generation)
+        threading.Thread(target=self._run, args=args, daemon=True).start()
+
+    def _run(self, url, token, generation, context):
+        with self.slots:
+            if token.cancelled:
+                return
+            try:
+                self.probe_func(url, token, generation, context)
+            finally:
+                with self.lock:
+                    if token is self.current_token:
+                        self.current_url = None
+                        self.current_token = None
+
+    def is_current(self, generation):
+        """結果是否來自最新一次的探測"""
+        return generation == self.generation
+
+class ThumbnailPrefetch:
+    """貼上時預取的縮略圖，綁定到同一次探測；探測需要縮略圖時等待預取結果再決定是否自行下載"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = b''
+
+    def finish(self, data):
+        self.data = data or b''
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """等待預取完成，回傳是否取得縮略圖"""
+        return self.done.wait(timeout) and bool(self.data)
+
+class SingleFlight:
+    """相同鍵的工作同時只執行一次，其他呼叫者等待並共用結果"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func, timeout=None):
+        """執行或等待工作，回傳 (結果, 是否共用他人的結果)"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None}
+        if not leader:
+            call['done'].wait(timeout)
+            return call['result'], True
+        try:
+            call['result'] = func()
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call['done'].set()
+        return call['result'], False
+
+class DownloadJob:
+    """下載佇列中的一個工作"""
+    WAITING = '排隊中'
+    RUNNING = '下載中'
+    PAUSED = '已暫停'
+    CANCELLED = '已取消'
+    DONE = '完成'
+    FAILED = '失敗'
+    TRANSCODING = '轉檔中'  # 下載已完成，等待或正在轉檔（不佔下載名額）
+
+    _ids = itertools.count(1)
+
+    def __init__(self, url, fmt, out_dir, quality='自動', priority=0, recipe=None, section=None, policy='editable'):
+        self.job_id = next(self._ids)
+        self.url = url
+        self.fmt = fmt
+        self.out_dir = out_dir
+        self.quality = quality
+        self.priority = priority
+        self.host = get_site_name(url)
+        self.status = self.WAITING
+        self.progress = ''
+        self.title = url
+        self.token = CancelToken()
+        self.journal_id = None
+        self.output_template = None  # 第一次執行時決定，續傳時沿用
+        self.format_selector = None
+        self.bytes_done = 0
+        self.recipe = recipe         # 下載後處理（PostRecipe）
+        self.section = section       # 只下載的片段（DownloadSection），None 表示完整影片
+        self.policy = policy         # 格式策略（FORMAT_POLICIES 的名稱）
+        self.saved_files = []        # 下載完成的檔案路徑
+        self.group = None            # 所屬的分 P 群組（PartGroup）
+        self.last_progress = None    # 最近一筆 DownloadProgress
+        self.progress_dirty = False  # 進度已更新但畫面尚未刷新
+        self.deferred_until = 0      # 等待磁碟空間時，在此時間之前不排程
+        self.active = False          # 執行緒仍在執行（暫停後 yt-dlp 可能尚未結束），結束前不再排程
+        self.live_confirmed = False  # 直播監看已確認開播，開始下載時不再檢查直播狀態
+        self.live_segment_minutes = None  # 直播分段錄製每段長度（分鐘），None 表示不分段
+        self.live_segment_audio = False   # 直播分段完成後抽出音訊
+        self.external_downloader = None   # 外部下載器（'aria2c'），None 使用 yt-dlp 內建下載
+
+class DownloadQueueManager:
+    """下載佇列：限制全域與每個網站的同時下載數，依優先順序（相同時先進先出）執行工作"""
+    DEFERRED = 'deferred'  # run_func 回傳此值表示暫時無法執行（例如磁碟空間不足），稍後重試
+    HANDOFF = 'handoff'    # run_func 回傳此值表示網路下載已完成、工作交給轉檔階段，之後以 finish() 結束
+    DEFER_SECONDS = 60
+
+    def __init__(self, run_func, max_concurrent=3, per_host=2, on_change=None, on_add_many=None):
+        self.run_func = run_func    # run_func(job) -> 是否成功，或 DEFERRED
+        self.on_change = on_change  # on_change(job)，工作狀態或進度改變時呼叫
+        self.on_add_many = on_add_many  # on_add_many(jobs)，一次加入多個工作時呼叫（未設定時逐一呼叫 on_change）
+        self.max_concurrent = max_concurrent
+        self.per_host = per_host
+        self.host_limits = {}       # 個別網站的同時下載上限，未設定時使用 per_host
+        self.lock = threading.RLock()
+        self.jobs = OrderedDict()   # job_id -> DownloadJob（依加入順序）
+
+    def add(self, url, fmt, out_dir, quality='自動', priority=0, recipe=None, section=None, policy='editable'):
+        return self.add_job(DownloadJob(url, fmt, out_dir, quality, priority, recipe, section, policy))
+
+    def add_job(self, job):
+        with self.lock:
+            self.jobs[job.job_id] = job
+        self.notify(job)
+        self.schedule()
+        return job
+
+    def add_many(self, jobs):
+        """一次加入多個工作（例如批次匯入）：只通知一次、排程一次"""
+        if not jobs:
+            return jobs
+        with self.lock:
+            for job in jobs:
+                self.jobs[job.job_id] = job
+        if self.on_add_many:
+            self.on_add_many(jobs)
+        else:
+            for job in jobs:
+                self.notify(job)
+        self.schedule()
+        return jobs
+
+    def notify(self, job):
+        if self.on_change:
+            self.on_change(job)
+
+    def running_count(self, host=None):
+        return sum(1 for job in self.jobs.values()
+                   if job.status == DownloadJob.RUNNING and (host is None or job.host == host))
+
+    def set_limits(self, max_concurrent=None, per_host=None):
+        with self.lock:
+            if max_concurrent is not None:
+                self.max_concurrent = max(1, max_concurrent)
+            if per_host is not None:
+                self.per_host = max(1, per_host)
+        self.schedule()
+
+    def schedule(self):
+        """在限制內啟動等待中的工作"""
+        started = []
+        now = time.time()
+        with self.lock:
+            # 每次排程只掃描一次工作清單，執行中數量在啟動工作時累加
+            running = {}
+            total = 0
+            waiting = []
+            for job in self.jobs.values():
+                if job.status == DownloadJob.RUNNING:
+                    running[job.host] = running.get(job.host, 0) + 1
+                    total += 1
+                elif job.status == DownloadJob.WAITING and not job.active and job.deferred_until <= now:
+                    waiting.append(job)
+            # 優先順序高者先執行；排序是穩定的，相同優先時最早加入的工作在前
+            waiting.sort(key=lambda job: job.priority, reverse=True)
+            for job in waiting:
+                if total >= self.max_concurrent:
+                    break
+                if running.get(job.host, 0) >= self.host_limits.get(job.host, self.per_host):
+                    continue
+                job.status = DownloadJob.RUNNING
+                job.active = True
+                running[job.host] = running.get(job.host, 0) + 1
+                total += 1
+                started.append(job)
+        for job in started:
+            self.notify(job)
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        ok = False
+        try:
+            ok = self.run_func(job)
+        except Exception as e:
+            log_error(f'下載工作 {job.job_id} 失敗: {str(e)}')
+        with self.lock:
+            # 暫停或取消時狀態已由 pause/cancel 設定
+            if job.status == DownloadJob.RUNNING and ok == self.DEFERRED:
+                job.status = DownloadJob.WAITING
+                job.deferred_until = time.time() + self.DEFER_SECONDS
+                timer = threading.Timer(self.DEFER_SECONDS, self.schedule)
+                timer.daemon = True
+                timer.start()
+            elif job.status == DownloadJob.RUNNING and ok == self.HANDOFF:
+                job.status = DownloadJob.TRANSCODING
+            elif job.status == DownloadJob.RUNNING:
+                job.status = DownloadJob.DONE if ok else DownloadJob.FAILED
+            # 暫停後立即繼續的工作要等這裡結束才會重新排程，避免兩個執行緒寫同一個 .part 檔
+            job.active = False
+        self.notify(job)
+        self.schedule()
+
+    def finish(self, job, ok):
+        """轉檔階段結束時完成交出的工作（已被取消的工作維持取消）
+
+        轉檔可能在下載執行緒將狀態改為轉檔中之前就結束，此時狀態仍是下載中，同樣直接完成；
+        _run 只改變下載中的工作，不會覆寫這裡的結果。
+        """
+        with self.lock:
+            if job.status not in (DownloadJob.RUNNING, DownloadJob.TRANSCODING):
+                return
+            job.status = DownloadJob.DONE if ok else DownloadJob.FAILED
+        self.notify(job)
+
+    def active_urls(self):
+        """尚未結束（排隊、下載、暫停、轉檔）的工作網址"""
+        with self.lock:
+            return {job.url for job in self.jobs.values()
+                    if job.status in (DownloadJob.WAITING, DownloadJob.RUNNING, DownloadJob.PAUSED, DownloadJob.TRANSCODING)}
+
+    def retry_deferred(self):
+        """有空間釋出時，讓等待中的工作立即重新嘗試"""
+        with self.lock:
+            for job in self.jobs.values():
+                job.deferred_until = 0
+        self.schedule()
+
+    def pause(self, job_id):
+        """暫停工作：下載中的工作會中止，恢復時由 yt-dlp 接續 .part 檔"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job.status not in (DownloadJob.WAITING, DownloadJob.RUNNING):
+                return
+            job.status = DownloadJob.PAUSED
+            job.token.cancel()
+        self.notify(job)
+        self.schedule()
+
+    def resume(self, job_id):
+        """繼續已暫停的工作，或重試失敗的工作"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job.status not in (DownloadJob.PAUSED, DownloadJob.FAILED):
+                return
+            job.status = DownloadJob.WAITING
+            job.token = CancelToken()
+            job.deferred_until = 0
+        self.notify(job)
+        self.schedule()
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job.status in (DownloadJob.DONE, DownloadJob.CANCELLED):
+                return
+            job.status = DownloadJob.CANCELLED
+            job.token.cancel()
+        self.notify(job)
+        self.schedule()
+
+    def set_priority(self, job_id, priority):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return
+            job.priority = priority
+        self.notify(job)
+
+    def remove_finished(self):
+        """移除已完成或已取消的工作，回傳被移除的工作"""
+        with self.lock:
+            removed = [job for job in self.jobs.values() if job.status in (DownloadJob.DONE, DownloadJob.CANCELLED)]
+            for job in removed:
+                del self.jobs[job.job_id]
+        return removed
+
+class TranscodePool:
+    """轉檔工作池：同時執行的 ffmpeg 轉檔數以 CPU 核心數為上限，與下載佇列的名額分開"""
+
+    def __init__(self, workers=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.slots = threading.BoundedSemaphore(self.workers)
+
+    def submit(self, func, *args):
+        """在背景執行緒等待空位後執行 func(*args)"""
+        threading.Thread(target=self._run, args=(func,) + args, daemon=True).start()
+
+    def _run(self, func, *args):
+        with self.slots:
+            try:
+                func(*args)
+            except Exception as e:
+                log_error(f'轉檔工作失敗: {str(e)}')
+
+class JobJournal:
+    """下載工作紀錄（SQLite）：程式關閉或當機後，未完成的工作可依紀錄接續下載"""
+
+    UNFINISHED = (DownloadJob.WAITING, DownloadJob.RUNNING, DownloadJob.PAUSED, DownloadJob.TRANSCODING)
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                fmt TEXT,
+                quality TEXT,
+                out_dir TEXT,
+                output_template TEXT,
+                format_selector TEXT,
+                priority INTEGER DEFAULT 0,
+                title TEXT,
+                state TEXT,
+                bytes_done INTEGER DEFAULT 0,
+                created REAL,
+                updated REAL,
+                recipe TEXT,
+                section TEXT,
+                policy TEXT
+            )
+        """)
+        # 舊版紀錄沒有下載後處理、片段與格式策略欄位
+        for column in ('recipe', 'section', 'policy'):
+            try:
+                self.conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} TEXT')
+            except sqlite3.OperationalError:
+                pass
+        self.conn.commit()
+
+    INSERT_SQL = ('INSERT INTO jobs (url, fmt, quality, out_dir, output_template, format_selector, priority, '
+                  'title, state, bytes_done, recipe, section, policy, updated, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+    UPDATE_SQL = ('UPDATE jobs SET url=?, fmt=?, quality=?, out_dir=?, output_template=?, format_selector=?, '
+                  'priority=?, title=?, state=?, bytes_done=?, recipe=?, section=?, policy=?, updated=? WHERE id=?')
+
+    @staticmethod
+    def _values(job, now):
+        recipe = json.dumps(job.recipe.to_dict()) if job.recipe else None
+        section = json.dumps(job.section.to_dict()) if job.section else None
+        return (job.url, job.fmt, job.quality, job.out_dir, job.output_template, job.format_selector,
+                job.priority, job.title, job.status, job.bytes_done, recipe, section, job.policy, now)
+
+    def record(self, job):
+        """新增或更新工作紀錄"""
+        now = time.time()
+        values = self._values(job, now)
+        with self.lock:
+            if job.journal_id is None:
+                cursor = self.conn.execute(self.INSERT_SQL, values + (now,))
+                job.journal_id = cursor.lastrowid
+            else:
+                self.conn.execute(self.UPDATE_SQL, values + (job.journal_id,))
+            self.conn.commit()
+
+    def record_many(self, jobs):
+        """一次新增或更新多筆工作紀錄（單一交易）"""
+        now = time.time()
+        new_jobs = [job for job in jobs if job.journal_id is None]
+        old_jobs = [job for job in jobs if job.journal_id is not None]
+        with self.lock:
+            if new_jobs:
+                self.conn.executemany(self.INSERT_SQL, [self._values(job, now) + (now,) for job in new_jobs])
+                # 同一交易內、只有本連線寫入，AUTOINCREMENT 的編號是連續的
+                last_id = self.conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                for offset, job in enumerate(new_jobs):
+                    job.journal_id = last_id - len(new_jobs) + 1 + offset
+            if old_jobs:
+                self.conn.executemany(self.UPDATE_SQL, [self._values(job, now) + (job.journal_id,) for job in old_jobs])
+            self.conn.commit()
+
+    def remove(self, job):
+        if job.journal_id is None:
+            return
+        with self.lock:
+            self.conn.execute('DELETE FROM jobs WHERE id=?', (job.journal_id,))
+            self.conn.commit()
+
+    def load_unfinished(self):
+        """讀取未完成的工作（依加入順序），重建為 DownloadJob"""
+        placeholders = ','.join('?' * len(self.UNFINISHED))
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT id, url, fmt, quality, out_dir, output_template, format_selector, priority, title, state, bytes_done, recipe, section, policy '
+                f'FROM jobs WHERE state IN ({placeholders}) ORDER BY id', self.UNFINISHED).fetchall()
+        jobs = []
+        for (journal_id, url, fmt, quality, out_dir, output_template, format_selector,
+             priority, title, state, bytes_done, recipe, section, policy) in rows:
+            job = DownloadJob(url, fmt, out_dir, quality, priority or 0, policy=policy or 'editable')
+            job.journal_id = journal_id
+            job.output_template = output_template
+            job.format_selector = format_selector
+            job.title = title or url
+            job.bytes_done = bytes_done or 0
+            if recipe:
+                job.recipe = PostRecipe.from_dict(json.loads(recipe))
+            if section:
+                job.section = DownloadSection.from_dict(json.loads(section))
+            # 暫停的工作維持暫停，其餘重新排隊
+            job.status = DownloadJob.PAUSED if state == DownloadJob.PAUSED else DownloadJob.WAITING
+            jobs.append(job)
+        return jobs
+
+    def prune(self, max_age=30 * 86400):
+        """刪除過舊的已結束紀錄"""
+        placeholders = ','.join('?' * len(self.UNFINISHED))
+        with self.lock:
+            self.conn.execute(f'DELETE FROM jobs WHERE state NOT IN ({placeholders}) AND updated < ?',
+                              self.UNFINISHED + (time.time() - max_age,))
+            self.conn.commit()
+
+def get_archive_key(url, extractor=None, video_id=None):
+    """取得下載紀錄的鍵（網站, 影片 ID）：可由網址辨識時不需連網，否則使用 yt-dlp 提供的 extractor 與 id"""
+    if extractor and video_id:
+        return extractor.lower(), str(video_id)
+    key = get_cache_key(url)
+    if ':' in key and '://' not in key and not key.startswith('tiktok_live:'):
+        site, video_id = key.split(':', 1)
+        return site, video_id
+    return None
+
+def sample_file_hash(path, sample_size=1024 * 1024):
+    """以檔案大小與開頭、中段、結尾各一段內容計算雜湊，大檔案也能快速比對"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - sample_size // 2), max(0, size - sample_size)}):
+            f.seek(offset)
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+class DownloadArchive:
+    """已下載影片的紀錄（SQLite），以（網站, 影片 ID, 格式）為鍵，避免重複下載"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive (
+                extractor TEXT NOT NULL,
+                video_id TEXT NOT NULL,
+                fmt TEXT NOT NULL,
+                path TEXT,
+                size INTEGER,
+                hash TEXT,
+                title TEXT,
+                added REAL,
+                PRIMARY KEY (extractor, video_id, fmt)
+            )
+        """)
+        self.conn.commit()
+
+    def add(self, keys, fmt, path, title=None):
+        """記錄下載完成的檔案；同一檔案可對應多個鍵（例如網址辨識的 ID 與 yt-dlp 回報的 ID 不同時）"""
+        size = os.path.getsize(path)
+        file_hash = sample_file_hash(path)
+        with self.lock:
+            for extractor, video_id in keys:
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO archive (extractor, video_id, fmt, path, size, hash, title, added) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (extractor, video_id, fmt, path, size, file_hash, title, time.time()))
+            self.conn.commit()
+
+    def lookup(self, key, fmt):
+        """查詢已下載的檔案，回傳 {'path', 'size', 'hash', 'title'}；檔案已被刪除或大小不符時移除紀錄並回傳 None"""
+        if not key:
+            return None
+        with self.lock:
+            row = self.conn.execute('SELECT path, size, hash, title FROM archive WHERE extractor=? AND video_id=? AND fmt=?',
+                                    key + (fmt,)).fetchone()
+            if not row:
+                return None
+            path, size, file_hash, title = row
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                self.conn.execute('DELETE FROM archive WHERE extractor=? AND video_id=? AND fmt=?', key + (fmt,))
+                self.conn.commit()
+                return None
+        return {'path': path, 'size': size, 'hash': file_hash, 'title': title}
+
+def get_entry_url(entry):
+    """--flat-playlist 項目的影片網址，無法取得時回傳 None"""
+    entry_url = entry.get('webpage_url') or entry.get('url')
+    if entry_url and not entry_url.startswith('http') and entry.get('ie_key') == 'Youtube':
+        entry_url = f'https://www.youtube.com/watch?v={entry_url}'
+    return entry_url
+
+def get_entry_date(entry):
+    """--flat-playlist 項目的上傳日期（YYYYMMDD），沒有日期資訊時回傳 None"""
+    if entry.get('upload_date'):
+        return entry['upload_date']
+    timestamp = entry.get('timestamp') or entry.get('release_timestamp')
+    return datetime.utcfromtimestamp(timestamp).strftime('%Y%m%d') if timestamp else None
+
+def get_sync_source_url(url):
+    """同步來源的網址：YouTube 頻道首頁會展開成多個分頁，改用「影片」分頁（由新到舊排列）"""
+    url = canonicalize_url(url.strip())
+    if re.search(r'youtube\.com/(@[^/?]+|channel/[^/?]+|c/[^/?]+|user/[^/?]+)$', url, re.I):
+        url += '/videos'
+    return url
+
+def is_newest_first_feed(url):
+    """清單是否由新到舊排列（頻道的影片分頁）；一般播放清單由舊到新排列，新項目加在最後"""
+    return bool(re.search(r'youtube\.com/(@[^/?]+|channel/[^/?]+|c/[^/?]+|user/[^/?]+)/(videos|shorts|streams)$', url, re.I)
+                or re.search(r'space\.bilibili\.com/\d+(/video|/upload/video)?/?$', url, re.I))
+
+class SyncSources:
+    """頻道／播放清單同步來源與各自的同步狀態，紀錄跨工作階段保存
+
+    由新到舊的頻道記錄高水位（最新已處理項目的 ID 與上傳日期）；其他播放清單記錄已見過的項目 ID。
+    已加入佇列但尚未下載完成的項目記在 pending，之後的同步會重試。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sources = self._load()
+
+    def _load(self):
+        return load_json(self.path, {})
+
+    def _save(self):
+        """寫入同步紀錄"""
+        try:
+            save_json_atomic(self.path, self.sources, ensure_ascii=False)
+        except Exception as e:
+            log_error(f"SyncSources 寫入錯誤: {str(e)}")
+
+    def urls(self):
+        with self.lock:
+            return list(self.sources)
+
+    def get(self, url):
+        with self.lock:
+            state = self.sources.get(url)
+            return dict(state) if state else None
+
+    def add(self, url, fmt, out_dir, quality='自動', policy='editable'):
+        """新增同步來源（已存在時只更新下載設定，保留高水位）"""
+        with self.lock:
+            state = self.sources.setdefault(url, {'last_id': None, 'last_date': None, 'last_sync': 0,
+                                                  'seen': [], 'pending': {}})
+            state.update(fmt=fmt, out_dir=out_dir, quality=quality, policy=policy)
+            self._save()
+
+    def remove(self, url):
+        with self.lock:
+            if self.sources.pop(url, None) is not None:
+                self._save()
+
+    def update(self, url, **fields):
+        with self.lock:
+            if url in self.sources:
+                self.sources[url].update(fields)
+                self._save()
+
+    def due(self, interval):
+        """距離上次同步超過 interval 秒的來源"""
+        now = time.time()
+        with self.lock:
+            return [url for url, state in self.sources.items() if now - state.get('last_sync', 0) >= interval]
+
+def get_stream_signature(path):
+    """以 ffmpeg 讀取檔案的串流參數（類型、編碼、解析度、取樣率、聲道），用於確認檔案能否直接串接；失敗時回傳 None"""
+    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+    try:
+        result = subprocess.run([get_ffmpeg_path(), '-hide_banner', '-i', path], capture_output=True,
+                                text=True, encoding='utf-8', errors='ignore', timeout=30, creationflags=creationflags)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    signature = []
+    for match in re.finditer(r'Stream #\d+:\d+.*?: (Video|Audio): (\w+)([^\n]*)', result.stderr):
+        kind, codec, rest = match.groups()
+        if kind == 'Video':
+            size = re.search(r'\b(\d{2,5})x(\d{2,5})\b', rest)
+            signature.append((kind, codec, size.group(0) if size else None))
+        else:
+            rate = re.search(r'(\d+) Hz, ([\w.()]+)', rest)
+            signature.append((kind, codec) + (rate.groups() if rate else (None, None)))
+    return tuple(signature) or None
+
+def list_bilibili_parts(bv_id, timeout=10):
+    """以 B 站公開 API 取得影片的分 P 清單 [{'page', 'title', 'duration'}]，失敗時回傳 None"""
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+        'Referer': 'https://www.bilibili.com/',
+    }
+    response = requests.get('https://api.bilibili.com/x/player/pagelist', params={'bvid': bv_id},
+                            headers=headers, timeout=timeout)
+    if response.status_code != 200:
+        return None
+    data = response.json()
+    if data.get('code') != 0 or not data.get('data'):
+        return None
+    return [{'page': item['page'], 'title': item.get('part') or f"P{item['page']}", 'duration': item.get('duration')}
+            for item in data['data']]
+
+class PartGroup:
+    """同一支影片的多個分 P 下載工作：全部完成後依分 P 順序無損合併"""
+
+    def __init__(self, title, items):
+        self.title = title
+        self.items = items  # 依分 P 順序的 (DownloadJob 或 None, 已下載的檔案路徑或 None)
+        self.lock = threading.Lock()
+        self.merged = False
+        self.format_selector = None  # 第一個開始下載的分 P 選定的格式，其餘分 P 沿用
+
+    def pin_format(self, selector):
+        """固定群組使用的格式：第一次呼叫的選擇器生效，之後回傳同一個選擇器"""
+        with self.lock:
+            if self.format_selector is None:
+                self.format_selector = selector
+            return self.format_selector
+
+    def ready_files(self):
+        """全部分 P 都已完成時回傳檔案路徑（依分 P 順序），否則回傳 None；只會成功回傳一次"""
+        files = []
+        with self.lock:
+            if self.merged:
+                return None
+            for job, path in self.items:
+                if job is not None:
+                    if job.status != DownloadJob.DONE or not job.saved_files:
+                        return None
+                    path = job.saved_files[0]
+                files.append(path)
+            self.merged = True
+        return files
+
+    def abandon_if_failed(self):
+        """有分 P 被取消時放棄合併，回傳 True（只回傳一次）；失敗的分 P 可重試，仍會等待"""
+        with self.lock:
+            if self.merged:
+                return False
+            if any(job is not None and job.status == DownloadJob.CANCELLED for job, _ in self.items):
+                self.merged = True
+                return True
+        return False
+
+def check_tiktok_live_page(url, timeout=10):
+    """以一般 HTTP 請求讀取 TikTok 直播頁判斷是否開播，回傳 True/False，無法判斷時回傳 None"""
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36'
+    }
+    response = requests.get(url, headers=headers, timeout=timeout)
+    if response.status_code != 200:
+        return None
+    # 直播頁內嵌的 liveRoom 資料中 status 為 2 表示直播中
+    match = re.search(r'"liveRoom(?:UserInfo)?"\s*:\s*\{.{0,4000}?"status"\s*:\s*(\d+)', response.text, re.S)
+    if not match:
+        return None
+    return match.group(1) == '2'
+
+class TikTokLiveWatcher(QThread):
+    """監看多個 TikTok 直播網址：未開播時逐步拉長檢查間隔，狀態改變時發出訊號"""
+    status_changed = pyqtSignal(str, bool)  # 網址, 是否直播中
+    check_failed = pyqtSignal(str, str)     # 網址, 錯誤訊息
+
+    def __init__(self, check_func, min_interval=30, max_interval=600):
+        super().__init__()
+        self.check_func = check_func  # check_func(url) -> True/False，無法判斷時回傳 None
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.wake_event = threading.Event()
+        self.watched = {}  # 網址 -> {'live', 'interval', 'next_check'}
+
+    def add_url(self, url):
+        with self.lock:
+            if url not in self.watched:
+                self.watched[url] = {'live': None, 'interval': self.min_interval, 'next_check': 0}
+        self.wake_event.set()
+
+    def remove_url(self, url):
+        with self.lock:
+            self.watched.pop(url, None)
+
+    def urls(self):
+        with self.lock:
+            return list(self.watched)
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            now = time.time()
+            with self.lock:
+                due = [url for url, state in self.watched.items() if state['next_check'] <= now]
+            for url in due:
+                if self.stop_event.is_set():
+                    return
+                self.check(url)
+            with self.lock:
+                next_check = min((state['next_check'] for state in self.watched.values()), default=now + self.max_interval)
+            self.wake_event.wait(max(1, min(next_check - time.time(), self.max_interval)))
+            self.wake_event.clear()
+
+    def check(self, url):
+        """檢查單一網址並依結果調整下次檢查時間"""
+        try:
+            live = self.check_func(url)
+            error = None if live is not None else '無法判斷直播狀態'
+        except Exception as e:
+            live = None
+            error = str(e)
+        if live is not None:
+            live = bool(live)
+        with self.lock:
+            state = self.watched.get(url)
+            if state is None:
+                return
+            changed = live is not None and live != state['live']
+            if live is not None:
+                state['live'] = live
+            if changed or live:
+                # 狀態剛改變或直播中：以最短間隔追蹤
+                state['interval'] = self.min_interval
+            else:
+                # 未開播或檢查失敗：間隔加倍直到上限，並加入少量隨機延遲避免同時檢查
+                state['interval'] = min(state['interval'] * 2, self.max_interval)
+            state['next_check'] = time.time() + state['interval'] * random.uniform(0.9, 1.1)
+        if error:
+            self.check_failed.emit(url, error)
+        elif changed:
+            self.status_changed.emit(url, live)
+
+# 子行程以 JSON 輸出進度（搭配 --newline 每筆一行），由 YtdlpEngine 解析為 DownloadProgress
+PROGRESS_PREFIX = 'GXTRO_PROGRESS '
+PROGRESS_ARGS = ['--newline', '--progress-template', f'download:{PROGRESS_PREFIX}%(progress)j']
+
+class DownloadProgress:
+    """一筆下載進度：兩種引擎的進度都轉換為此格式"""
+    __slots__ = ('status', 'filename', 'downloaded', 'total', 'speed', 'eta', 'fragment_index', 'fragment_count')
+
+    def __init__(self, d):
+        self.status = d.get('status') or 'downloading'
+        self.filename = d.get('filename') or ''
+        self.downloaded = int(d.get('downloaded_bytes') or 0)
+        self.total = int(d.get('total_bytes') or d.get('total_bytes_estimate') or 0)
+        self.speed = float(d.get('speed') or 0)
+        self.eta = d.get('eta')
+        self.fragment_index = d.get('fragment_index')
+        self.fragment_count = d.get('fragment_count')
+
+    @classmethod
+    def from_line(cls, line):
+        """解析子行程輸出的進度行，不是進度行時回傳 None"""
+        if not line.startswith(PROGRESS_PREFIX):
+            return None
+        try:
+            return cls(json.loads(line[len(PROGRESS_PREFIX):]))
+        except (ValueError, AttributeError):
+            return None
+
+    @property
+    def fraction(self):
+        """完成比例（0~1），無法得知時回傳 None"""
+        if self.status == 'finished':
+            return 1.0
+        if self.total:
+            return min(self.downloaded / self.total, 1.0)
+        if self.fragment_index and self.fragment_count:
+            return min(self.fragment_index / self.fragment_count, 1.0)
+        return None
+
+    def describe(self):
+        """進度文字，例如「42.0% 12.3/29.1MiB 3.20MiB/s ETA 5s」"""
+        parts = []
+        if self.fraction is not None:
+            parts.append(f'{self.fraction * 100:.1f}%')
+        size = f'{self.downloaded / 1024 / 1024:.1f}'
+        parts.append(f'{size}/{self.total / 1024 / 1024:.1f}MiB' if self.total else f'{size}MiB')
+        if self.fragment_index and self.fragment_count:
+            parts.append(f'片段 {self.fragment_index}/{self.fragment_count}')
+        if self.speed:
+            parts.append(f'{self.speed / 1024 / 1024:.2f}MiB/s')
+        if self.eta is not None:
+            parts.append(f'ETA {int(self.eta)}s')
+        return ' '.join(parts)
+
+# TikTok 下載共用的 yt-dlp 參數
+TIKTOK_DOWNLOAD_ARGS = [
+    '--extractor-args', 'tiktok:api_hostname=api22-normal-c-useast1a.tiktokv.com',
+    '--extractor-args', 'tiktok:app_version=22.1.3',
+    '--extractor-args', 'tiktok:device_id=7163339161873573377',
+    '--extractor-args', 'tiktok:manifest_app_version=22.1.3',
+    '--extractor-args', 'tiktok:api_url=https://api22-normal-c-useast1a.tiktokv.com/passport/web/user/query/',
+    '--extractor-args', 'tiktok:api_key=aweme_v3_web',
+    '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+    '--no-check-certificate'
+]
+
+class SegmentedLiveRecorder:
+    """直播分段錄製：yt-dlp 將串流輸出到 stdout，由 ffmpeg segment muxer 每 N 分鐘切成可獨立播放的檔案
+
+    ffmpeg 每完成一段就寫入分段清單，監看清單即可在錄製途中取得已完成的分段。
+    需要串接兩個子行程，因此固定使用 yt-dlp 子行程。
+    """
+
+    def __init__(self, url, out_dir, segment_minutes=30, ytdlp_args=None, on_segment=None, on_line=None):
+        self.url = url
+        self.out_dir = out_dir
+        self.segment_minutes = segment_minutes
+        self.ytdlp_args = ytdlp_args or []
+        self.on_segment = on_segment  # on_segment(path)，每完成一段呼叫一次
+        self.on_line = on_line or (lambda line: None)
+        name = re.sub(r'[^\w\-]', '_', urllib.parse.urlparse(url).path.replace('/live', '')).strip('_') or 'live'
+        self.prefix = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.list_path = os.path.join(out_dir, f'{self.prefix}_segments.csv')
+        self.segments = []
+
+    def build_commands(self):
+        ytdlp_cmd = ['yt-dlp', '--no-part', '--quiet', '--no-warnings'] + self.ytdlp_args + ['-o', '-', self.url]
+        ffmpeg_cmd = [
+            get_ffmpeg_path(), '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0', '-map', '0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', str(self.segment_minutes * 60),
+            '-reset_timestamps', '1', '-segment_format', 'mp4',
+            '-segment_list', self.list_path, '-segment_list_type', 'csv',
+            os.path.join(self.out_dir, f'{self.prefix}_%03d.mp4')
+        ]
+        return ytdlp_cmd, ffmpeg_cmd
+
+    def _collect_segments(self):
+        """讀取分段清單，對新完成的分段呼叫 on_segment"""
+        try:
+            with open(self.list_path, 'r', encoding='utf-8') as f:
+                names = [line.split(',')[0] for line in f if line.strip()]
+        except OSError:
+            return
+        for name in names[len(self.segments):]:
+            path = name if os.path.isabs(name) else os.path.join(self.out_dir, name)
+            self.segments.append(path)
+            if self.on_segment:
+                self.on_segment(path)
+
+    def run(self, token=None):
+        """錄製到直播結束或被取消為止，回傳已完成的分段清單"""
+        ytdlp_cmd, ffmpeg_cmd = self.build_commands()
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        ytdlp_proc = subprocess.Popen(ytdlp_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      creationflags=creationflags)
+        ffmpeg_proc = subprocess.Popen(ffmpeg_cmd, stdin=ytdlp_proc.stdout, stderr=subprocess.PIPE,
+                                       creationflags=creationflags)
+        # 只由 ffmpeg 讀取 yt-dlp 的輸出；yt-dlp 結束時 ffmpeg 收到 EOF 並完成最後一段
+        ytdlp_proc.stdout.close()
+        if token:
+            token.proc = ytdlp_proc
+            if token.cancelled:
+                ytdlp_proc.kill()
+
+        def read_errors(stream, prefix):
+            for line in stream:
+                self.on_line(f'{prefix}{line.decode(errors="ignore").strip()}')
+        threading.Thread(target=read_errors, args=(ytdlp_proc.stderr, ''), daemon=True).start()
+        threading.Thread(target=read_errors, args=(ffmpeg_proc.stderr, '[ffmpeg] '), daemon=True).start()
+
+        while ffmpeg_proc.poll() is None:
+            time.sleep(2)
+            self._collect_segments()
+        ytdlp_proc.wait()
+        self._collect_segments()
+        return self.segments
+
+class _EngineLogger:
+    """將行程內 yt-dlp 的輸出轉為逐行回呼，與子行程模式的輸出處理方式一致"""
+
+    def __init__(self, on_line=None):
+        self.on_line = on_line
+        self.errors = []
+
+    def debug(self, msg):
+        if self.on_line:
+            self.on_line(msg)
+
+    def info(self, msg):
+        self.debug(msg)
+
+    def warning(self, msg):
+        self.debug(msg)
+
+    def error(self, msg):
+        self.errors.append(msg)
+        self.debug(msg)
+
+class ExtractorCache:
+    """由程式管理的 yt-dlp 快取目錄（YouTube 播放器 / nsig 解法等）：限制容量、yt-dlp 版本變更時清除
+
+    以 with 使用：使用中的工作以計數保護，清除與淘汰只在沒有工作使用時進行，否則延到最後一個工作結束。
+    """
+    WARM_URL = 'https://www.youtube.com/watch?v=jNQXAC9IVRw'  # 預熱用的短片，只需取得播放器資訊
+    WARM_MAX_AGE = 3600  # 預熱結果的有效時間（秒），超過時啟動程式會重新預熱
+    PRUNE_INTERVAL = 600
+
+    def __init__(self, root, max_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.cache_dir = os.path.join(root, 'cache')
+        self.state_path = os.path.join(root, 'state.json')
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.users = 0
+        self.pending = {}       # 等待沒有工作使用時執行的維護：{'clear': bool, 'prune': bool}
+        self.last_prune = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        return load_json(self.state_path, {})
+
+    def _save_state(self):
+        try:
+            save_json_atomic(self.state_path, self.state)
+        except Exception as e:
+            log_error(f"ExtractorCache 狀態寫入錯誤: {str(e)}")
+
+    def args(self):
+        return ['--cache-dir', self.cache_dir]
+
+    def __enter__(self):
+        with self.lock:
+            self.users += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.users -= 1
+            if not self.pending and time.time() - self.last_prune >= self.PRUNE_INTERVAL:
+                self.pending['prune'] = True
+            if self.users == 0 and self.pending:
+                self._maintain()
+        return False
+
+    def _files(self):
+        files = []
+        for dirpath, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def _maintain(self):
+        """執行延後的清除或淘汰（需持有 lock 且沒有工作使用）"""
+        pending, self.pending = self.pending, {}
+        if pending.get('clear'):
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            return
+        self.last_prune = time.time()
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _request(self, action):
+        with self.lock:
+            self.pending[action] = True
+            if self.users == 0:
+                self._maintain()
+
+    def check_version(self, version):
+        """yt-dlp 版本改變時清除快取（舊版的播放器解法可能不適用），回傳是否清除"""
+        if not version or self.state.get('version') == version:
+            return False
+        changed = 'version' in self.state
+        self.state = {'version': version, 'warmed': 0}
+        self._save_state()
+        if changed:
+            self._request('clear')
+        return changed
+
+    def prune(self):
+        self._request('prune')
+
+    def needs_warm(self):
+        """播放器解法會隨 YouTube 更新而失效，距上次預熱超過 WARM_MAX_AGE 就重新預熱"""
+        return time.time() - float(self.state.get('warmed') or 0) >= self.WARM_MAX_AGE
+
+    def mark_warmed(self):
+        self.state['warmed'] = time.time()
+        self._save_state()
+
+class YtdlpEngine:
+    """yt-dlp 執行引擎：在行程內呼叫 yt_dlp.YoutubeDL，無法使用時退回 yt-dlp 子行程"""
+
+    def __init__(self, use_inprocess=True, cache=None):
+        self.use_inprocess = use_inprocess and self.inprocess_available()
+        self.cache = cache  # ExtractorCache，所有命令共用，None 時使用 yt-dlp 預設快取
+
+    def _with_cache(self, cmd):
+        """將命令的快取目錄改為管理中的目錄"""
+        if not self.cache:
+            return cmd
+        cmd = [arg for arg in cmd if arg != '--no-cache-dir']
+        return cmd[:1] + self.cache.args() + cmd[1:]
+
+    def version(self):
+        """yt-dlp 版本，無法取得時回傳 None"""
+        if self.use_inprocess:
+            return getattr(getattr(yt_dlp, 'version', None), '__version__', None)
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        try:
+            result = subprocess.run(['yt-dlp', '--version'], capture_output=True, text=True,
+                                    timeout=15, creationflags=creationflags)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        return result.stdout.strip() or None
+
+    @staticmethod
+    def inprocess_available():
+        """是否可在行程內執行（需安裝含 parse_options 的 yt_dlp 套件）"""
+        return yt_dlp is not None and hasattr(yt_dlp, 'parse_options')
+
+    def mode_name(self):
+        return '行程內' if self.use_inprocess else '子行程'
+
+    def _parse(self, cmd, drop=()):
+        """將 yt-dlp 命令列轉換為 YoutubeDL 參數，無法轉換時回傳 None"""
+        args = [arg for arg in cmd[1:] if arg not in drop]
+        try:
+            parsed = yt_dlp.parse_options(args)
+        except (Exception, SystemExit) as e:
+            log_error(f"YtdlpEngine 參數轉換錯誤: {str(e)}")
+            return None
+        ydl_opts = dict(parsed.ydl_opts)
+        ffmpeg_path = get_ffmpeg_path()
+        if ffmpeg_path != 'ffmpeg' and not ydl_opts.get('ffmpeg_location'):
+            ydl_opts['ffmpeg_location'] = os.path.dirname(ffmpeg_path)
+        return parsed, ydl_opts
+
+    def dump_json(self, cmd, timeout=30, token=None):
+        """執行 --dump-json 探測命令，回傳 (影片資訊, 錯誤訊息)；子行程逾時會拋出 subprocess.TimeoutExpired
+
+        token 被取消時會終止子行程；行程內模式無法中斷擷取，只會捨棄結果。
+        """
+        if not self.cache:
+            return self._dump_json(cmd, timeout, token)
+        with self.cache:
+            return self._dump_json(self._with_cache(cmd), timeout, token)
+
+    def _dump_json(self, cmd, timeout, token):
+        if self.use_inprocess:
+            result = self._parse(cmd, drop=('--dump-json', '-j'))
+            if result:
+                parsed, ydl_opts = result
+                logger = _EngineLogger()
+                ydl_opts.update({'logger': logger, 'quiet': True, 'simulate': True, 'socket_timeout': timeout})
+                try:
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        info = ydl.extract_info(parsed.urls[0], download=False)
+                        if token and token.cancelled:
+                            return None, '探測已取消'
+                        return ydl.sanitize_info(info), '\n'.join(logger.errors)
+                except Exception as e:
+                    return None, '\n'.join(logger.errors) or str(e)
+
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            creationflags=creationflags
+        )
+        if token:
+            token.proc = proc
+            if token.cancelled:
+                proc.kill()
+        try:
+            output, error = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            raise
+        if token and token.cancelled:
+            return None, '探測已取消'
+        if not output:
+            return None, error
+        try:
+            return json.loads(output), error
+        except json.JSONDecodeError as e:
+            return None, f'解析影片信息失敗: {str(e)}\n原始輸出: {output[:200]}...\n{error}'
+
+    def iter_flat_entries(self, cmd, token=None):
+        """逐筆產生 --flat-playlist 的播放清單項目；子行程模式逐行解析 NDJSON，不保留整份輸出"""
+        if not self.cache:
+            yield from self._iter_flat_entries(cmd, token)
+            return
+        with self.cache:
+            yield from self._iter_flat_entries(self._with_cache(cmd), token)
+
+    def _iter_flat_entries(self, cmd, token):
+        if self.use_inprocess:
+            result = self._parse(cmd, drop=('--dump-json', '-j', '--flat-playlist'))
+            if result:
+                parsed, ydl_opts = result
+                ydl_opts.update({'logger': _EngineLogger(), 'quiet': True,
+                                 'extract_flat': 'in_playlist', 'lazy_playlist': True})
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    info = ydl.extract_info(parsed.urls[0], download=False, process=False)
+                    if not info:
+                        return
+                    if info.get('entries') is None:
+                        yield info
+                        return
+                    for entry in info['entries']:
+                        if token and token.cancelled:
+                            return
+                        if entry:
+                            yield entry
+                return
+
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            creationflags=creationflags
+        )
+        if token:
+            token.proc = proc
+        try:
+            for line in proc.stdout:
+                if token and token.cancelled:
+                    break
+                line = line.strip()
+                if not line.startswith('{'):
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+    def run(self, cmd, on_line, on_progress=None, env=None, token=None, bandwidth=None):
+        """執行下載命令並逐行回報輸出，回傳結束碼（0 為成功）
+
+        on_progress 收到 DownloadProgress；token 被取消時中止下載，bandwidth 為頻寬額度。
+        """
+        if token and token.cancelled:
+            return 1
+        if not self.cache:
+            return self._run(cmd, on_line, on_progress, env, token, bandwidth)
+        with self.cache:
+            return self._run(self._with_cache(cmd), on_line, on_progress, env, token, bandwidth)
+
+    def _run(self, cmd, on_line, on_progress, env, token, bandwidth):
+        if self.use_inprocess:
+            result = self._parse(cmd)
+            if result:
+                parsed, ydl_opts = result
+                ydl_opts['logger'] = _EngineLogger(on_line)
+                hooks = []
+                if on_progress:
+                    # 進度改由 hook 直接提供數值，不再輸出文字進度列
+                    ydl_opts['noprogress'] = True
+                    hooks.append(lambda d: on_progress(DownloadProgress(d)))
+                if token:
+                    def check_cancelled(d):
+                        if token.cancelled:
+                            raise yt_dlp.utils.DownloadCancelled('已取消下載')
+                    hooks.append(check_cancelled)
+                if bandwidth:
+                    # 在下載執行緒中依令牌桶睡眠，頻寬調整即時生效
+                    hooks.append(bandwidth.progress_hook)
+                ydl_opts['progress_hooks'] = hooks
+                try:
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        if parsed.options.load_info_filename:
+                            return ydl.download_with_info_file(parsed.options.load_info_filename)
+                        return ydl.download(parsed.urls)
+                except Exception as e:
+                    on_line(f'ERROR: {str(e)}')
+                    return 1
+
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        while True:
+            applied_rate = bandwidth.rate if bandwidth else 0
+            run_cmd = cmd[:1] + ['--limit-rate', str(applied_rate)] + cmd[1:] if applied_rate else cmd
+            proc = subprocess.Popen(
+                run_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env=env,
+                creationflags=creationflags
+            )
+            if token:
+                token.proc = proc
+                if token.cancelled:
+                    proc.kill()
+            restarted = []
+            # 只在下載階段內重新啟動；下載結束後的合併、轉檔中途終止會失去已完成的處理
+            phase = {'downloading': False, 'eta': None}
+            if bandwidth:
+                threading.Thread(target=self._watch_bandwidth, args=(proc, bandwidth, applied_rate, restarted, phase), daemon=True).start()
+            for line in proc.stdout:
+                line = line.strip()
+                progress = DownloadProgress.from_line(line)
+                if progress is None:
+                    on_line(line)
+                    continue
+                phase['downloading'] = progress.status == 'downloading'
+                phase['eta'] = progress.eta
+                if on_progress:
+                    on_progress(progress)
+            proc.wait()
+            if restarted and not (token and token.cancelled):
+                # 子行程無法即時調整速率，以新的 --limit-rate 重新啟動，yt-dlp 會由 .part 檔接續
+                on_line(f'[bandwidth] 頻寬分配改為 {bandwidth.rate or "不限速"}，重新啟動下載')
+                continue
+            return proc.returncode
+
+    def _watch_bandwidth(self, proc, bandwidth, applied_rate, restarted, phase):
+        """監看頻寬分配，下載中且變動過大、已執行一段時間時終止子行程以便重新啟動"""
+        started = time.time()
+        while proc.poll() is None:
+            time.sleep(2)
+            if (time.time() - started >= 15 and phase['downloading']
+                    and bandwidth.needs_restart(applied_rate, phase['eta'])):
+                restarted.append(True)
+                proc.kill()
+                return
+
 class YTDLPDownloader(QMainWindow):
     CURRENT_VERSION = "1.06.12" # 更新當前版本
 
@@ -647,6 +2913,40 @@ class YTDLPDownloader(QMainWindow):
         
         # 初始化下載資料夾
         self.download_folder = os.path.expanduser("~/Downloads")
+
+        # 初始化 yt-dlp 執行引擎（行程內優先，無法使用時退回子行程）
+        # yt-dlp 快取（YouTube 播放器解法等）由程式管理，所有下載與探測共用
+        self.extractor_cache = ExtractorCache(get_data_dir('ytdlp_cache'))
+        self.ytdlp_engine = YtdlpEngine(cache=self.extractor_cache)
+
+        # 初始化影片資訊快取與格式索引（每次探測只建立一次索引）
+        self.info_cache = InfoCache(get_data_dir('info_cache'))
+        QCoreApplication.instance().aboutToQuit.connect(self.info_cache.flush)
+        self.format_indexes = OrderedDict()
+
+        # 初始化下載佇列（工作狀態改變時交由主執行緒更新佇列畫面）
+        self.job_journal = JobJournal(os.path.join(get_data_dir(), 'jobs.db'))
+        self.download_archive = DownloadArchive(os.path.join(get_data_dir(), 'archive.db'))
+        self.download_queue = DownloadQueueManager(self.run_download_job, on_change=self.on_queue_job_changed,
+                                                   on_add_many=self.on_queue_jobs_added)
+        self.queue_rows = {}  # job_id -> 佇列表格的列
+        self.transcode_pool = TranscodePool()  # MP3 轉檔與網路下載分開排程
+        self.download_recipe = None  # 套用到之後加入佇列的下載（PostRecipe）
+        self.bilibili_parts = {}  # 快取鍵 -> 多 P 影片各分 P 的網址
+
+        # 初始化各網站分段下載連線數的自動調整（紀錄保存在資料夾中）
+        self.site_tuner = SiteTuner(os.path.join(get_data_dir(), 'site_tuning.json'))
+
+        # 初始化頻寬分配（預設不限速，保留部分頻寬給探測與縮略圖）
+        self.bandwidth = BandwidthManager()
+        # 磁碟空間准入控制：釋出預留空間時讓等待空間的工作重新嘗試
+        self.disk_space = DiskSpaceManager(on_release=lambda: self.download_queue.retry_deferred())
+
+        # 初始化畫質探測排程（只套用最新網址的結果）
+        self.probe_scheduler = ProbeScheduler(self.fetch_qualities_and_thumbnail)
+        # 進行中的探測：下載時直接等待並共用貼上時已開始的探測結果
+        self.inflight_probes = SingleFlight()
+        self.thumbnail_prefetches = {}  # 探測 generation -> ThumbnailPrefetch
         
         # 創建 UI
         self.init_ui()
@@ -663,12 +2963,36 @@ class YTDLPDownloader(QMainWindow):
         self.log_timer.timeout.connect(self.process_log_queue)
         self.log_timer.start()
 
+        # 創建定時器用於刷新下載佇列的進度條
+        self.queue_progress_timer = QTimer(self)
+        self.queue_progress_timer.setInterval(250)
+        self.queue_progress_timer.timeout.connect(self.refresh_queue_progress)
+        self.queue_progress_timer.start()
+
         self.apply_styles()
         
         threading.Thread(target=self.auto_connect, daemon=True).start()
         
         # 啟動版本檢查
         self.start_version_check()
+
+        # 在背景檢查 yt-dlp 版本並預熱快取
+        threading.Thread(target=self.warm_extractor_cache, daemon=True).start()
+
+        # 啟動 TikTok 直播監看
+        self.start_live_watcher()
+
+        # 接續上次未完成的下載
+        self.resume_journal_jobs()
+
+        # 頻道同步：啟動一分鐘後檢查一次，之後每小時檢查超過一天未同步的來源
+        self.sync_sources = SyncSources(os.path.join(get_data_dir(), 'sync_sources.json'))
+        self.syncing_sources = set()
+        self.sync_timer = QTimer(self)
+        self.sync_timer.setInterval(3600 * 1000)
+        self.sync_timer.timeout.connect(self.sync_due_sources)
+        self.sync_timer.start()
+        QTimer.singleShot(60 * 1000, self.sync_due_sources)
         
         # 預設將視窗最大化
         self.showMaximized()
@@ -769,6 +3093,12 @@ class YTDLPDownloader(QMainWindow):
             open_folder_action = QAction('開啟下載資料夾', self)
             open_folder_action.triggered.connect(self.open_download_folder)
             file_menu.addAction(open_folder_action)
+            import_file_action = QAction('從文字檔批次匯入網址...', self)
+            import_file_action.triggered.connect(self.import_urls_from_file)
+            file_menu.addAction(import_file_action)
+            import_clipboard_action = QAction('從剪貼簿批次匯入網址', self)
+            import_clipboard_action.triggered.connect(self.import_urls_from_clipboard)
+            file_menu.addAction(import_clipboard_action)
             exit_action = QAction('退出', self)
             exit_action.triggered.connect(self.close)
             file_menu.addAction(exit_action)
@@ -821,6 +3151,64 @@ class YTDLPDownloader(QMainWindow):
             self.embed_metadata_action.triggered.connect(self.toggle_embed_metadata)
             settings_menu.addAction(self.embed_metadata_action)
 
+            # 新增清除影片資訊快取選項
+            clear_info_cache_action = QAction('清除影片資訊快取', self)
+            clear_info_cache_action.triggered.connect(self.clear_info_cache)
+            settings_menu.addSeparator()
+            settings_menu.addAction(clear_info_cache_action)
+
+            # 新增 yt-dlp 引擎選項
+            self.inprocess_engine_action = QAction('行程內 yt-dlp 引擎', self, checkable=True)
+            self.inprocess_engine_action.setChecked(self.ytdlp_engine.use_inprocess)
+            self.inprocess_engine_action.setEnabled(YtdlpEngine.inprocess_available())
+            self.inprocess_engine_action.triggered.connect(self.toggle_inprocess_engine)
+            settings_menu.addAction(self.inprocess_engine_action)
+            probe_benchmark_action = QAction('探測速度測試', self)
+            probe_benchmark_action.triggered.connect(self.start_probe_benchmark)
+            settings_menu.addAction(probe_benchmark_action)
+            bandwidth_action = QAction('頻寬限制...', self)
+            bandwidth_action.triggered.connect(self.set_bandwidth_limits)
+            settings_menu.addAction(bandwidth_action)
+            self.aria2c_action = QAction('使用 aria2c 多連線下載', self, checkable=True)
+            self.aria2c_action.setEnabled(shutil.which('aria2c') is not None)
+            self.aria2c_action.toggled.connect(self.on_download_settings_changed)
+            settings_menu.addAction(self.aria2c_action)
+
+            # 新增 TikTok 直播監看選項
+            live_watch_action = QAction('直播監看清單...', self)
+            live_watch_action.triggered.connect(self.edit_live_watch_list)
+            settings_menu.addSeparator()
+            settings_menu.addAction(live_watch_action)
+            self.live_auto_record_action = QAction('開播時自動錄製', self, checkable=True)
+            self.live_auto_record_action.setChecked(True)
+            settings_menu.addAction(self.live_auto_record_action)
+            self.live_segment_action = QAction('直播分段錄製', self, checkable=True)
+            settings_menu.addAction(self.live_segment_action)
+            live_segment_minutes_action = QAction('直播分段長度...', self)
+            live_segment_minutes_action.triggered.connect(self.set_live_segment_minutes)
+            settings_menu.addAction(live_segment_minutes_action)
+            self.live_segment_audio_action = QAction('分段完成後抽出音訊', self, checkable=True)
+            settings_menu.addAction(self.live_segment_audio_action)
+            # 背景執行緒不可讀取元件，改讀取主執行緒在選項改變時更新的值
+            self.live_segment_minutes = 30
+            self.on_download_settings_changed()
+            for action in (self.live_segment_action, self.live_segment_audio_action):
+                action.toggled.connect(self.on_download_settings_changed)
+
+            # 頻道／播放清單同步
+            sync_sources_action = QAction('同步來源清單...', self)
+            sync_sources_action.triggered.connect(self.edit_sync_sources)
+            settings_menu.addSeparator()
+            settings_menu.addAction(sync_sources_action)
+            sync_now_action = QAction('立即同步全部來源', self)
+            sync_now_action.triggered.connect(lambda: self.sync_all_sources())
+            settings_menu.addAction(sync_now_action)
+            self.auto_sync_action = QAction('每日自動同步', self, checkable=True)
+            self.auto_sync_action.setChecked(True)
+            settings_menu.addAction(self.auto_sync_action)
+            self.concat_parts_action = QAction('分P下載完成後合併', self, checkable=True)
+            settings_menu.addAction(self.concat_parts_action)
+
             # 新增剪輯選單
             edit_menu = menubar.addMenu('剪輯')
             self.edit_mode_action = QAction('剪輯模式', self, checkable=True)
@@ -890,13 +3278,19 @@ class YTDLPDownloader(QMainWindow):
             self.url_input = QLineEdit()
             self.url_input.setPlaceholderText('請貼上影片網址...')
             self.url_input.textChanged.connect(self.update_format_options)
+            # 網址輸入停止變動後才自動查詢畫質，合併連續的編輯
+            self.probe_debounce_timer = QTimer(self)
+            self.probe_debounce_timer.setSingleShot(True)
+            self.probe_debounce_timer.setInterval(600)
+            self.probe_debounce_timer.timeout.connect(self.update_quality_options)
+            self.url_input.textChanged.connect(self.probe_debounce_timer.start)
             paste_btn = QPushButton('貼上')
             paste_btn.clicked.connect(self.paste_url)
             clear_btn = QPushButton('清除')
             clear_btn.clicked.connect(self.clear_url)
             # 新增查詢畫質按鈕
             query_quality_btn = QPushButton('查詢畫質')
-            query_quality_btn.clicked.connect(self.update_quality_options)
+            query_quality_btn.clicked.connect(lambda: self.update_quality_options())
             url_layout.addWidget(url_label)
             url_layout.addWidget(self.url_input)
             url_layout.addWidget(paste_btn)
@@ -907,7 +3301,7 @@ class YTDLPDownloader(QMainWindow):
             format_label = QLabel('格式:')
             format_label.setStyleSheet('font-size: 13px;')
             self.format_combo = QComboBox()
-            self.format_combo.addItems(['mp4', 'mp3'])
+            self.format_combo.addItems(['mp4'] + list(AUDIO_FORMATS))
             format_layout.addWidget(format_label)
             format_layout.addWidget(self.format_combo)
 
@@ -919,6 +3313,18 @@ class YTDLPDownloader(QMainWindow):
             format_layout.addWidget(quality_label)
             format_layout.addWidget(self.quality_combo)
 
+            # 格式策略：依用途挑選編碼（預設挑選可直接預覽與剪輯的 H.264/AAC）
+            policy_label = QLabel('用途:')
+            policy_label.setStyleSheet('font-size: 13px;')
+            self.policy_combo = QComboBox()
+            for name, text in FORMAT_POLICIES.items():
+                self.policy_combo.addItem(text, name)
+            # 背景執行緒不可讀取元件，改讀取主執行緒在選項改變時更新的值
+            self.format_policy = self.policy_combo.currentData() or 'editable'
+            self.policy_combo.currentIndexChanged.connect(self.on_format_policy_changed)
+            format_layout.addWidget(policy_label)
+            format_layout.addWidget(self.policy_combo)
+
             path_layout = QHBoxLayout()
             path_label = QLabel('下載資料夾:')
             path_label.setStyleSheet('font-size: 13px;')
@@ -963,9 +3369,17 @@ class YTDLPDownloader(QMainWindow):
             self.preview_settings_layout = QHBoxLayout()
             
             # 左側預覽
+            # 播放清單項目（展開播放清單/頻道時逐筆加入，雙擊查詢該項目畫質）
+            self.playlist_list = QListWidget()
+            self.playlist_list.setSelectionMode(QListWidget.ExtendedSelection)
+            self.playlist_list.setMaximumWidth(320)
+            self.playlist_list.itemDoubleClicked.connect(self.expand_playlist_entry)
+            self.playlist_list.setVisible(False)
+
             preview_layout = QVBoxLayout()
             preview_layout.addWidget(self.thumbnail_label)
             preview_layout.addWidget(self.title_label_video)
+            preview_layout.addWidget(self.playlist_list)
             preview_layout.addStretch()
             
             # 右側設置
@@ -974,6 +3388,67 @@ class YTDLPDownloader(QMainWindow):
             settings_layout.addLayout(format_layout)
             settings_layout.addLayout(path_layout)
             settings_layout.addWidget(self.download_btn)
+
+            # 下載後處理設定
+            recipe_layout = QHBoxLayout()
+            recipe_btn = QPushButton('下載後處理...')
+            recipe_btn.clicked.connect(self.edit_download_recipe)
+            self.recipe_label = QLabel('下載後處理: 無')
+            self.recipe_label.setStyleSheet('font-size: 12px;')
+            recipe_layout.addWidget(recipe_btn)
+            recipe_layout.addWidget(self.recipe_label, 1)
+            settings_layout.addLayout(recipe_layout)
+
+            # 片段下載：只抓取指定時間範圍，時間格式與剪輯面板相同
+            section_layout = QHBoxLayout()
+            self.section_check = QCheckBox('只下載片段')
+            self.section_start_input = QLineEdit()
+            self.section_start_input.setPlaceholderText('開始 HH:MM:SS')
+            self.section_end_input = QLineEdit()
+            self.section_end_input.setPlaceholderText('結束 HH:MM:SS（空白為結尾）')
+            self.section_exact_check = QCheckBox('精確裁切')
+            self.section_exact_check.setToolTip('在切點重新編碼，裁切位置精確到影格（較慢）；未勾選時從最近的關鍵影格直接複製')
+            section_layout.addWidget(self.section_check)
+            section_layout.addWidget(self.section_start_input)
+            section_layout.addWidget(QLabel('-'))
+            section_layout.addWidget(self.section_end_input)
+            section_layout.addWidget(self.section_exact_check)
+            settings_layout.addLayout(section_layout)
+
+            # 下載佇列
+            queue_group = QGroupBox('下載佇列')
+            queue_layout = QVBoxLayout()
+            self.queue_table = QTableWidget(0, 5)
+            self.queue_table.setHorizontalHeaderLabels(['標題', '格式', '狀態', '進度', '優先'])
+            self.queue_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+            self.queue_table.verticalHeader().setVisible(False)
+            self.queue_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+            self.queue_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+            self.queue_table.setMinimumHeight(120)
+            queue_layout.addWidget(self.queue_table)
+            queue_btn_layout = QHBoxLayout()
+            for text, slot in (('暫停', self.pause_selected_jobs), ('繼續', self.resume_selected_jobs),
+                               ('取消', self.cancel_selected_jobs), ('提高優先', self.raise_selected_jobs_priority),
+                               ('清除已完成', self.clear_finished_jobs)):
+                btn = QPushButton(text)
+                btn.clicked.connect(slot)
+                queue_btn_layout.addWidget(btn)
+            queue_btn_layout.addStretch()
+            queue_btn_layout.addWidget(QLabel('同時下載:'))
+            self.max_concurrent_spin = QSpinBox()
+            self.max_concurrent_spin.setRange(1, 10)
+            self.max_concurrent_spin.setValue(self.download_queue.max_concurrent)
+            self.max_concurrent_spin.valueChanged.connect(self.update_queue_limits)
+            queue_btn_layout.addWidget(self.max_concurrent_spin)
+            queue_btn_layout.addWidget(QLabel('每個網站:'))
+            self.per_host_spin = QSpinBox()
+            self.per_host_spin.setRange(1, 10)
+            self.per_host_spin.setValue(self.download_queue.per_host)
+            self.per_host_spin.valueChanged.connect(self.update_queue_limits)
+            queue_btn_layout.addWidget(self.per_host_spin)
+            queue_layout.addLayout(queue_btn_layout)
+            queue_group.setLayout(queue_layout)
+            settings_layout.addWidget(queue_group)
             
             # 將預覽和設置添加到水平佈局
             self.preview_settings_layout.addLayout(preview_layout)
@@ -1249,6 +3724,35 @@ class YTDLPDownloader(QMainWindow):
     def paste_url(self):
         clipboard = QApplication.clipboard()
         self.url_input.setText(clipboard.text())
+        # 貼上時不等待輸入防抖，立即開始探測並同時預取縮略圖
+        self.update_quality_options(prefetch_thumbnail=True)
+
+    def guess_thumbnail_url(self, url):
+        """由網址直接推算縮略圖位置（目前僅 YouTube），不需等待影片資訊"""
+        key = get_cache_key(url)
+        if key.startswith('youtube:'):
+            return f'https://i.ytimg.com/vi/{key.split(":", 1)[1]}/hqdefault.jpg'
+        return None
+
+    def prepare_thumbnail_prefetch(self, url, generation):
+        """探測啟動前建立該次探測的縮略圖預取（只保留最新一次）"""
+        thumbnail_url = self.guess_thumbnail_url(url)
+        if not thumbnail_url:
+            self.thumbnail_prefetches = {}
+            return
+        prefetch = ThumbnailPrefetch()
+        self.thumbnail_prefetches = {generation: prefetch}
+        threading.Thread(target=self.prefetch_thumbnail, args=(thumbnail_url, prefetch, generation), daemon=True).start()
+
+    def prefetch_thumbnail(self, thumbnail_url, prefetch, generation):
+        """與探測同時下載推算出的縮略圖，成功後探測完成時不再重複下載"""
+        data = b''
+        try:
+            data = self.fetch_thumbnail_data(thumbnail_url)
+        finally:
+            prefetch.finish(data)
+        if data and self.probe_scheduler.is_current(generation):
+            QCoreApplication.instance().postEvent(self, ProbeResultEvent(generation, None, None, data))
 
     def clear_url(self):
         self.url_input.clear()
@@ -1430,173 +3934,480 @@ class YTDLPDownloader(QMainWindow):
             return
         if any(site in url for site in ['youtube', 'bilibili']):
             self.format_combo.clear()
-            self.format_combo.addItems(['mp4', 'mp3'])
+            self.format_combo.addItems(['mp4'] + list(AUDIO_FORMATS))
         elif any(site in url for site in ['tiktok', 'twitter', 'facebook', 'fb', 'instagram', 'vimeo', 'twitch']):
             self.format_combo.clear()
             self.format_combo.addItems(['mp4'])
         else:
             self.format_combo.clear()
-            self.format_combo.addItems(['mp4', 'mp3'])
+            self.format_combo.addItems(['mp4'] + list(AUDIO_FORMATS))
 
-    def update_quality_options(self):
+    def update_quality_options(self, prefetch_thumbnail=False):
+        self.probe_debounce_timer.stop()
         url = self.url_input.text().strip()
         url = extract_url(url)
+        if not url.startswith('http'):
+            return
+        if not is_playlist_url(url):
+            self.playlist_list.clear()
+            self.playlist_list.setVisible(False)
         self.quality_combo.clear()
         self.quality_combo.addItem('自動')
-        if not url:
-            return
-        threading.Thread(target=self.fetch_qualities_and_thumbnail, args=(url,), daemon=True).start()
+        prepare = None
+        if prefetch_thumbnail and not is_playlist_url(url):
+            prepare = lambda generation: self.prepare_thumbnail_prefetch(url, generation)
+        self.probe_scheduler.submit(url, prepare, {'fmt': self.format_combo.currentText()})
+
+    def build_probe_command(self, url):
+        """建立取得影片資訊的 yt-dlp 命令（回傳清理後的網址與命令）"""
+        # 清理 Instagram URL
+        if 'instagram.com' in url.lower():
+            # 移除 URL 參數
+            url = url.split('?')[0]
+            # 確保 URL 格式正確
+            if not url.endswith('/'):
+                url += '/'
+
+            # Instagram 特定的命令
+            cmd = [
+                'yt-dlp',
+                '--dump-json',
+                '--no-warnings',
+                '--extractor-args', 'instagram:login_required=False',
+                '--extractor-args', 'instagram:include_stories=True',
+                '--extractor-args', 'instagram:include_highlights=True',
+                '--extractor-args', 'instagram:include_posts=True',
+                '--extractor-args', 'instagram:include_reels=True',
+                '--extractor-args', 'instagram:include_igtv=True',
+                '--extractor-args', 'instagram:max_posts=1',
+                '--extractor-args', 'instagram:max_stories=1',
+                '--extractor-args', 'instagram:max_highlights=1',
+                '--extractor-args', 'instagram:max_reels=1',
+                '--extractor-args', 'instagram:max_igtv=1',
+                '--no-check-certificate',
+                url
+            ]
+        else:
+            cmd = ['yt-dlp', '--dump-json', url]
+        return url, cmd
 
-    def fetch_qualities_and_thumbnail(self, url):
+    def get_video_info(self, url, timeout=30, use_cache=True, token=None):
+        """取得影片資訊：優先讀取快取，同一網址正在探測時共用其結果，否則執行 yt-dlp --dump-json 並寫入快取"""
         url = extract_url(url)
-        default_qualities = ['自動', '1080p', '720p', '480p', '360p', '240p']
+        if use_cache:
+            video_info = self.info_cache.get(url)
+            if video_info:
+                self.log(f'使用快取的影片資訊: {get_cache_key(url)}', 'debug')
+                return video_info
+
+        key = get_cache_key(url)
+        video_info, shared = self.inflight_probes.do(key, lambda: self.probe_video_info(url, timeout, token), timeout)
+        if shared:
+            if video_info:
+                self.log(f'共用進行中的探測結果: {key}', 'debug')
+                return video_info
+            # 共用的探測失敗或已被取消，自行重新探測一次
+            video_info, _ = self.inflight_probes.do(key, lambda: self.probe_video_info(url, timeout, token), timeout)
+        return video_info
+
+    def probe_video_info(self, url, timeout=30, token=None):
+        """執行 yt-dlp --dump-json 取得影片資訊並寫入快取"""
+        url, cmd = self.build_probe_command(url)
+        self.log(f'獲取影片信息 ({self.ytdlp_engine.mode_name()}): {cmd}', 'debug')
+
         try:
-            # 清理 Instagram URL
-            if 'instagram.com' in url.lower():
-                # 移除 URL 參數
-                url = url.split('?')[0]
-                # 確保 URL 格式正確
-                if not url.endswith('/'):
-                    url += '/'
-                
-                # Instagram 特定的命令
-                cmd = [
-                    'yt-dlp',
-                    '--dump-json',
-                    '--no-warnings',
-                    '--extractor-args', 'instagram:login_required=False',
-                    '--extractor-args', 'instagram:include_stories=True',
-                    '--extractor-args', 'instagram:include_highlights=True',
-                    '--extractor-args', 'instagram:include_posts=True',
-                    '--extractor-args', 'instagram:include_reels=True',
-                    '--extractor-args', 'instagram:include_igtv=True',
-                    '--extractor-args', 'instagram:max_posts=1',
-                    '--extractor-args', 'instagram:max_stories=1',
-                    '--extractor-args', 'instagram:max_highlights=1',
-                    '--extractor-args', 'instagram:max_reels=1',
-                    '--extractor-args', 'instagram:max_igtv=1',
-                    '--no-check-certificate',
-                    url
-                ]
+            video_info, error = self.ytdlp_engine.dump_json(cmd, timeout=timeout, token=token)
+        except subprocess.TimeoutExpired:
+            self.log('獲取影片信息超時，請檢查網路或重試', 'debug')
+            return None
+
+        if error:
+            self.log(f'錯誤信息: {error}', 'debug')
+
+        if not video_info:
+            self.log('未獲取到影片信息', 'debug')
+            return None
+
+        self.info_cache.put(url, video_info)
+        self.format_indexes.pop(get_cache_key(url), None)
+        return video_info
+
+    def get_format_index(self, url, video_info=None):
+        """取得網址的格式索引，尚未建立時由影片資訊建立（已取得的 video_info 可直接傳入，不再讀取快取檔）"""
+        key = get_cache_key(url)
+        if key in self.format_indexes:
+            self.format_indexes.move_to_end(key)
+            return self.format_indexes[key]
+        if video_info is None:
+            video_info = self.get_video_info(url)
+        if not video_info:
+            return None
+        index = FormatIndex(video_info.get('formats'))
+        self.format_indexes[key] = index
+        while len(self.format_indexes) > 100:
+            self.format_indexes.popitem(last=False)
+        return index
+
+    def get_fresh_info_json(self, url):
+        """取得可交給 yt-dlp --load-info-json 的快取檔案；串流網址已過期或即將過期時重新解析一次"""
+        info = self.info_cache.get(url)
+        if info and info.get('_type', 'video') == 'video' and not info.get('is_live'):
+            expiry = get_signed_url_expiry(info)
+            if expiry is None or expiry - time.time() > SIGNED_URL_MARGIN:
+                return self.info_cache.get_path(url)
+            self.log('快取的串流網址已過期，重新解析影片資訊', 'debug')
+            info = self.get_video_info(url, use_cache=False)
+            if info and info.get('_type', 'video') == 'video':
+                return self.info_cache.get_path(url)
+        return None
+
+    def get_format_selector(self, url, quality, policy='editable'):
+        """依格式策略與畫質從格式索引中挑選 -f 選擇器，並在日誌說明選擇原因"""
+        index = self.get_format_index(url)
+        selector, reason = index.selector_for_policy(policy, quality) if index else (None, None)
+        if selector:
+            self.log(f'格式策略「{FORMAT_POLICIES.get(policy, policy)}」選擇 {reason}', 'info')
+            return selector
+        height = (quality or '').replace('p', '')
+        selector = POLICY_FALLBACK_SELECTORS.get(policy, POLICY_FALLBACK_SELECTORS['editable']).format(
+            h=f'[height<={height}]' if height.isdigit() else '')
+        self.log(f'沒有格式資訊，格式策略「{FORMAT_POLICIES.get(policy, policy)}」使用通用選擇器: {selector}', 'info')
+        return selector
+
+    def warm_extractor_cache(self):
+        """yt-dlp 版本改變時清除快取；上次預熱已過期時預先解析 YouTube 播放器，之後的下載不必再處理 JS 驗證"""
+        try:
+            version = self.ytdlp_engine.version()
+            if self.extractor_cache.check_version(version):
+                self.log(f'yt-dlp 版本已更新為 {version}，已清除 yt-dlp 快取', 'info')
+            self.extractor_cache.prune()
+            if not self.extractor_cache.needs_warm():
+                return
+            self.log('預熱 yt-dlp 快取...', 'debug')
+            video_info, error = self.ytdlp_engine.dump_json(['yt-dlp', '--dump-json', '--no-playlist', ExtractorCache.WARM_URL], timeout=60)
+            if video_info:
+                self.extractor_cache.mark_warmed()
+                self.log('yt-dlp 快取預熱完成', 'debug')
             else:
-                cmd = ['yt-dlp', '--dump-json', url]
-            
-            self.log(f'獲取影片信息: {cmd}', 'debug')
-            
-            creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                creationflags=creationflags
-            )
-            
-            try:
-                output, error = proc.communicate(timeout=30)  # 減少超時時間到30秒
-                
-                if error:
-                    self.log(f'錯誤信息: {error}', 'debug')
-                
-                if not output:
-                    self.log('未獲取到影片信息', 'debug')
-                    return
-                
+                self.log(f'yt-dlp 快取預熱失敗: {error}', 'debug')
+        except Exception as e:
+            self.log(f'yt-dlp 快取預熱失敗: {str(e)}', 'debug')
+
+    def toggle_inprocess_engine(self):
+        """切換 yt-dlp 引擎模式"""
+        self.ytdlp_engine = YtdlpEngine(self.inprocess_engine_action.isChecked(), self.extractor_cache)
+        self.log(f'yt-dlp 引擎模式: {self.ytdlp_engine.mode_name()}', 'info')
+
+    def start_probe_benchmark(self):
+        """以目前網址比較兩種引擎的探測延遲"""
+        url = extract_url(self.url_input.text().strip())
+        if not url:
+            QMessageBox.warning(self, '提示', '請先輸入要測試的影片網址')
+            return
+        if not YtdlpEngine.inprocess_available():
+            QMessageBox.warning(self, '提示', '未安裝 yt_dlp 套件，無法比較行程內引擎')
+            return
+        threading.Thread(target=self.run_probe_benchmark, args=(url,), daemon=True).start()
+
+    def run_probe_benchmark(self, url, rounds=3):
+        """執行探測速度測試：每種模式探測數次（不使用快取），記錄第一次與平均延遲"""
+        url, cmd = self.build_probe_command(url)
+        self.log(f'開始探測速度測試: {url}', 'info')
+        for use_inprocess in (False, True):
+            engine = YtdlpEngine(use_inprocess, self.extractor_cache)
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
                 try:
-                    import json
-                    video_info = json.loads(output)
-                    
-                    # 顯示影片名稱
-                    if 'title' in video_info:
-                        self.title_label_video.setText(video_info['title'])
-                    else:
-                        self.title_label_video.setText('')
-                    
-                    # 獲取縮略圖URL
-                    thumbnail_url = None
-                    if 'thumbnail' in video_info:
-                        thumbnail_url = video_info['thumbnail']
-                    elif 'thumbnails' in video_info and video_info['thumbnails']:
-                        # 嘗試獲取最高質量的縮略圖
-                        thumbnails = sorted(
-                            video_info['thumbnails'],
-                            key=lambda x: x.get('width', 0) * x.get('height', 0),
-                            reverse=True
-                        )
-                        if thumbnails:
-                            thumbnail_url = thumbnails[0]['url']
-                    
-                    if thumbnail_url:
-                        self.log(f'找到縮略圖: {thumbnail_url}', 'debug')
-                        self.thumbnail_url = thumbnail_url
-                        self.download_and_show_thumbnail(self.thumbnail_url)
-                    else:
-                        self.log('未找到縮略圖', 'debug')
-                    
-                    # 獲取可用格式
-                    if 'formats' in video_info:
-                        qualities = set()
-                        for fmt in video_info['formats']:
-                            if 'height' in fmt and fmt.get('vcodec', 'none') != 'none':
-                                h = fmt['height']
-                                # 對應常見畫質
-                                if h >= 1080:
-                                    quality = '1080p'
-                                elif h >= 720:
-                                    quality = '720p'
-                                elif h >= 480:
-                                    quality = '480p'
-                                elif h >= 360:
-                                    quality = '360p'
-                                elif h >= 240:
-                                    quality = '240p'
-                                else:
-                                    quality = f"{h}p"
-                                qualities.add(quality)
-                        if qualities:
-                            qualities = sorted(
-                                list(qualities),
-                                key=lambda x: int(x.replace('p', '')),
-                                reverse=True
-                            )
-                            self.log(f'可用畫質: {", ".join(qualities)}', 'debug')
-                            self.quality_combo.clear()
-                            self.quality_combo.addItem('自動')
-                            for q in qualities:
-                                self.quality_combo.addItem(q)
-                        else:
-                            self.log('未找到可用畫質', 'debug')
-                            self.quality_combo.clear()
-                            for q in default_qualities:
-                                self.quality_combo.addItem(q)
-                    else:
-                        self.log('未找到格式信息', 'debug')
-                        self.quality_combo.clear()
-                        for q in default_qualities:
-                            self.quality_combo.addItem(q)
-                            
-                except json.JSONDecodeError as e:
-                    self.log(f'解析影片信息失敗: {str(e)}', 'debug')
-                    self.log(f'原始輸出: {output[:200]}...', 'debug')
-                    self.quality_combo.clear()
-                    for q in default_qualities:
-                        self.quality_combo.addItem(q)
-                    
-            except subprocess.TimeoutExpired:
-                proc.kill()
-                self.log('獲取影片信息超時，請檢查網路或重試', 'debug')
-                self.quality_combo.clear()
-                for q in default_qualities:
-                    self.quality_combo.addItem(q)
-                
+                    video_info, _ = engine.dump_json(cmd)
+                except subprocess.TimeoutExpired:
+                    video_info = None
+                if not video_info:
+                    self.log(f'{engine.mode_name()}模式探測失敗，略過', 'info')
+                    break
+                timings.append(time.perf_counter() - started)
+            if timings:
+                self.log(f'{engine.mode_name()}模式: 第一次 {timings[0]:.2f}s，'
+                         f'平均 {sum(timings) / len(timings):.2f}s，最快 {min(timings):.2f}s（共 {len(timings)} 次）', 'info')
+
+    def set_bandwidth_limits(self):
+        """設定總頻寬與單一下載的速率上限（MB/s，0 表示不限速）"""
+        total, ok = QInputDialog.getDouble(self, '頻寬限制', '總頻寬上限（MB/s，0 為不限速）：',
+                                           self.bandwidth.global_limit / 1024 / 1024, 0, 10000, 1)
+        if not ok:
+            return
+        per_job, ok = QInputDialog.getDouble(self, '頻寬限制', '單一下載上限（MB/s，0 為不限速）：',
+                                             self.bandwidth.per_job_limit / 1024 / 1024, 0, 10000, 1)
+        if not ok:
+            return
+        self.bandwidth.set_limits(int(total * 1024 * 1024), int(per_job * 1024 * 1024))
+        self.log(f'頻寬限制: 總計 {total or "不限"} MB/s，單一下載 {per_job or "不限"} MB/s'
+                 f'（保留 {int(self.bandwidth.probe_reserve * 100)}% 給畫質查詢與縮略圖）', 'info')
+
+    def clear_info_cache(self):
+        """清除影片資訊快取"""
+        self.info_cache.clear()
+        self.format_indexes.clear()
+        self.log('已清除影片資訊快取', 'info')
+
+    def fetch_qualities_and_thumbnail(self, url, token=None, generation=None, context=None):
+        """在背景取得畫質、標題與縮略圖，完成後交由主執行緒更新介面（context 為提交時的介面設定）"""
+        url = extract_url(url)
+        fmt = (context or {}).get('fmt', 'mp4')
+        if is_playlist_url(url):
+            self.expand_playlist(url, token, generation, fmt)
+            return
+        if 'bilibili.com' in url.lower():
+            url = self.expand_bilibili_parts(url, token, generation, fmt)
+        default_qualities = ['自動', '1080p', '720p', '480p', '360p', '240p']
+        title = None
+        qualities = default_qualities
+        thumbnail_data = None
+        try:
+            video_info = self.get_video_info(url, token=token)
+            if token and token.cancelled:
+                self.log(f'已取消過期的畫質查詢: {url}', 'debug')
+                return
+            if video_info:
+                # 影片名稱
+                title = video_info.get('title', '')
+
+                # 獲取縮略圖URL
+                thumbnail_url = None
+                if 'thumbnail' in video_info:
+                    thumbnail_url = video_info['thumbnail']
+                elif 'thumbnails' in video_info and video_info['thumbnails']:
+                    # 嘗試獲取最高質量的縮略圖
+                    thumbnails = sorted(
+                        video_info['thumbnails'],
+                        key=lambda x: x.get('width', 0) * x.get('height', 0),
+                        reverse=True
+                    )
+                    if thumbnails:
+                        thumbnail_url = thumbnails[0]['url']
+
+                prefetch = self.thumbnail_prefetches.get(generation)
+                if prefetch and prefetch.wait(15):
+                    self.log('縮略圖已於貼上時預取，略過下載', 'debug')
+                elif thumbnail_url:
+                    self.log(f'找到縮略圖: {thumbnail_url}', 'debug')
+                    self.thumbnail_url = thumbnail_url
+                    thumbnail_data = self.fetch_thumbnail_data(thumbnail_url)
+                else:
+                    self.log('未找到縮略圖', 'debug')
+
+                # 獲取可用格式（由格式索引取得，不再掃描 formats）
+                index = self.get_format_index(url, video_info)
+                found = index.quality_labels() if index else []
+                if found:
+                    self.log(f'可用畫質: {", ".join(found)}', 'debug')
+                    qualities = ['自動'] + found
+                else:
+                    self.log('未找到可用畫質', 'debug')
+
         except Exception as e:
             self.log(f'獲取影片信息失敗: {str(e)}', 'debug')
             self.log(traceback.format_exc(), 'debug')
+
+        if token and token.cancelled:
+            return
+        QCoreApplication.instance().postEvent(
+            self,
+            ProbeResultEvent(generation, title, qualities, thumbnail_data)
+        )
+
+    def expand_bilibili_parts(self, url, token=None, generation=None, fmt='mp4'):
+        """未指定分 P 的 B 站網址若有多個分 P，列出各分 P 供選取，回傳用來查詢畫質的網址（第一 P）"""
+        bv_id, part = get_bilibili_part(url)
+        if not bv_id or part:
+            return url
+        try:
+            parts = list_bilibili_parts(bv_id)
+        except (requests.RequestException, ValueError) as e:
+            self.log(f'取得分 P 清單失敗: {str(e)}', 'debug')
+            parts = None
+        if not parts or len(parts) < 2 or (token and token.cancelled):
+            return url
+        entries = []
+        for item in parts:
+            entry_url = get_bilibili_url(bv_id, item['page'])
+            existing = self.find_archived(entry_url, fmt)
+            entries.append({
+                'url': entry_url,
+                'title': f"P{item['page']} {item['title']}",
+                'duration': item['duration'],
+                'archived': existing['path'] if existing else None,
+            })
+        self.log(f'{bv_id} 共有 {len(entries)} 個分 P，下載時各分 P 會分別加入佇列', 'info')
+        parts = (get_cache_key(url), [entry['url'] for entry in entries])
+        QCoreApplication.instance().postEvent(self, PlaylistEntriesEvent(generation, entries, True, True, parts))
+        return entries[0]['url']
+
+    def expand_playlist(self, url, token=None, generation=None, fmt='mp4'):
+        """串流展開播放清單：每收到一批項目就交給主執行緒顯示，只保留顯示所需的欄位"""
+        cmd = ['yt-dlp', '--flat-playlist', '--dump-json', url]
+        self.log(f'展開播放清單 ({self.ytdlp_engine.mode_name()}): {cmd}', 'debug')
+        batch = []
+        first_batch = True
+        count = 0
+        last_post = time.time()
+        try:
+            for entry in self.ytdlp_engine.iter_flat_entries(cmd, token=token):
+                entry_url = get_entry_url(entry)
+                if not entry_url:
+                    continue
+                archived = self.find_archived(entry_url, fmt, entry.get('ie_key'), entry.get('id'))
+                batch.append({
+                    'url': entry_url,
+                    'title': entry.get('title') or entry.get('id') or entry_url,
+                    'duration': entry.get('duration'),
+                    'archived': archived['path'] if archived else None,
+                })
+                count += 1
+                if len(batch) >= 50 or time.time() - last_post > 0.3:
+                    QCoreApplication.instance().postEvent(self, PlaylistEntriesEvent(generation, batch, first_batch, False))
+                    batch = []
+                    first_batch = False
+                    last_post = time.time()
+        except Exception as e:
+            self.log(f'展開播放清單失敗: {str(e)}', 'debug')
+        if token and token.cancelled:
+            self.log(f'已取消過期的播放清單展開: {url}', 'debug')
+            return
+        self.log(f'播放清單共 {count} 個項目', 'info')
+        QCoreApplication.instance().postEvent(self, PlaylistEntriesEvent(generation, batch, first_batch, True))
+
+    def apply_playlist_entries(self, event):
+        """在主執行緒加入播放清單項目"""
+        if event.generation is not None and not self.probe_scheduler.is_current(event.generation):
+            return
+        if event.parts:
+            key, part_urls = event.parts
+            self.bilibili_parts[key] = part_urls
+        if event.first_batch:
+            self.playlist_list.clear()
+            self.playlist_list.setVisible(True)
+            self.title_label_video.setText('播放清單（雙擊項目查詢畫質，選取後按下載）')
+        for entry in event.entries:
+            label = entry['title']
+            if entry.get('duration'):
+                label = f"{label} [{self.format_time(entry['duration'] * 1000, 'second')}]"
+            if entry.get('archived'):
+                label = f'✓ {label}'
+            item = QListWidgetItem(label)
+            item.setData(Qt.UserRole, entry['url'])
+            if entry.get('archived'):
+                item.setToolTip(f"已下載: {entry['archived']}")
+            self.playlist_list.addItem(item)
+
+    def expand_playlist_entry(self, item):
+        """雙擊播放清單項目時才查詢該項目的完整格式"""
+        entry_url = item.data(Qt.UserRole)
+        self.quality_combo.clear()
+        self.quality_combo.addItem('自動')
+        self.probe_scheduler.submit(entry_url, context={'fmt': self.format_combo.currentText()})
+
+    def get_selected_playlist_urls(self):
+        """取得播放清單中已選取項目的網址"""
+        if not self.playlist_list.isVisible():
+            return []
+        return [item.data(Qt.UserRole) for item in self.playlist_list.selectedItems()]
+
+    def download_playlist_entries(self, urls, fmt, out_dir, quality):
+        """將播放清單中選取的項目加入下載佇列；同一支影片的分 P 可在全部完成後合併"""
+        bv_ids = {get_bilibili_part(entry_url)[0] for entry_url in urls}
+        same_video = len(bv_ids) == 1 and None not in bv_ids
+        if not same_video and len(urls) > 1:
+            # 不同影片的可用畫質不一定相同
+            quality = '自動'
+        results = self.build_download_jobs(urls, fmt, out_dir, quality, recipe=self.download_recipe)
+        group = None
+        if same_video and len(urls) > 1 and self.concat_parts_action.isChecked():
+            # 加入佇列前就設定群組，開始下載的分 P 才會沿用同一個格式
+            items = [(job, existing['path'] if existing else None) for job, existing in results]
+            group = PartGroup(self.title_label_video.text(), items)
+            for job, _ in items:
+                if job:
+                    job.group = group
+        self.add_download_jobs(results)
+        if group:
+            self.check_part_group(group)
+
+    def check_part_group(self, group):
+        """分 P 全部完成時在背景合併（以 concat 串接、不重新編碼）"""
+        if group.abandon_if_failed():
+            self.log('有分 P 被取消，略過合併', 'info')
+            return
+        files = group.ready_files()
+        if files:
+            threading.Thread(target=self.merge_part_files, args=(files,), daemon=True).start()
+
+    def merge_part_files(self, files):
+        """依分 P 順序將檔案無損串接成一個檔案；各分 P 的串流參數不一致時不合併"""
+        signatures = [get_stream_signature(path) for path in files]
+        if None in signatures or len(set(signatures)) > 1:
+            detail = '、'.join(f'P{i + 1}: {sig}' for i, sig in enumerate(signatures))
+            self.log(f'各分 P 的編碼或解析度不一致，無法無損合併，略過合併（{detail}）', 'info')
+            return
+        stem, ext = os.path.splitext(files[0])
+        output_path = f'{stem}_合併{ext}'
+        total = sum(os.path.getsize(path) for path in files if os.path.exists(path))
+        reservation = None
+        try:
+            status, reservation, available = self.disk_space.reserve(
+                os.path.dirname(os.path.abspath(output_path)), total, os.path.basename(output_path))
+        except OSError as e:
+            self.log(f'無法檢查磁碟空間，略過空間檢查: {e}', 'debug')
+            status = DiskSpaceManager.OK
+        if status != DiskSpaceManager.OK:
+            self.log(f'磁碟空間不足（需要約 {format_bytes(total)}，可用 {format_bytes(max(0, available))}），略過分 P 合併', 'error')
+            return
+        list_fd, list_path = tempfile.mkstemp(suffix='.txt', prefix='gxtro_concat_')
+
+        def cleanup():
+            try:
+                os.remove(list_path)
+            except OSError:
+                pass
+            if reservation:
+                self.disk_space.release(reservation)
+
+        def on_complete(output):
+            cleanup()
+            self.log(f'分 P 已合併: {output_path}', 'info')
+
+        def on_error(error):
+            cleanup()
+            self.log(f'分 P 合併失敗: {error}', 'error')
+
+        with os.fdopen(list_fd, 'w', encoding='utf-8') as f:
+            for path in files:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        command = [get_ffmpeg_path(), '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+                   '-c', 'copy', output_path]
+        self.log(f'開始合併 {len(files)} 個分 P: {os.path.basename(output_path)}', 'info')
+        run_ffmpeg_command(command, lambda msg, level='debug': self.log(msg, 'debug'), on_complete, on_error)
+
+    def apply_probe_result(self, event):
+        """在主執行緒套用畫質查詢結果，已被新網址取代的結果直接捨棄"""
+        if event.generation is not None and not self.probe_scheduler.is_current(event.generation):
+            self.log('捨棄過期的畫質查詢結果', 'debug')
+            return
+        if event.title is not None:
+            self.title_label_video.setText(event.title)
+        if event.qualities is not None:
+            current = self.quality_combo.currentText()
             self.quality_combo.clear()
-            for q in default_qualities:
+            for q in event.qualities:
                 self.quality_combo.addItem(q)
+            if current in event.qualities:
+                self.quality_combo.setCurrentText(current)
+        if event.thumbnail_data is not None:
+            self.show_thumbnail_data(event.thumbnail_data)
 
-    def download_and_show_thumbnail(self, url):
+    def fetch_thumbnail_data(self, url):
+        """下載縮略圖，回傳圖片資料；失敗時回傳空位元組"""
         try:
             self.log(f'開始下載縮略圖: {url}', 'debug')
             headers = {
@@ -1604,26 +4415,31 @@ class YTDLPDownloader(QMainWindow):
             }
             response = requests.get(url, headers=headers, timeout=10)
             if response.status_code == 200:
-                image_data = BytesIO(response.content)
-                pixmap = QPixmap()
-                if pixmap.loadFromData(image_data.getvalue()):
-                    # 保持寬高比縮放圖片
-                    scaled_pixmap = pixmap.scaled(
-                        self.thumbnail_label.size(),
-                        Qt.KeepAspectRatio,
-                        Qt.SmoothTransformation
-                    )
-                    self.thumbnail_label.setPixmap(scaled_pixmap)
-                    self.log('縮略圖載入成功', 'debug')
-                else:
-                    self.log('縮略圖格式不支援', 'debug')
-                    self.thumbnail_label.setText('縮略圖格式不支援')
-            else:
-                self.log(f'下載縮略圖失敗: HTTP {response.status_code}', 'debug')
-                self.thumbnail_label.setText('無法載入封面')
+                return response.content
+            self.log(f'下載縮略圖失敗: HTTP {response.status_code}', 'debug')
         except Exception as e:
             self.log(f'載入封面失敗: {str(e)}', 'debug')
-            self.thumbnail_label.setText('載入封面失敗')
+        return b''
+
+    def show_thumbnail_data(self, data):
+        """顯示縮略圖（需在主執行緒呼叫）"""
+        if not data:
+            self.thumbnail_label.setText('無法載入封面')
+            return
+        image_data = BytesIO(data)
+        pixmap = QPixmap()
+        if pixmap.loadFromData(image_data.getvalue()):
+            # 保持寬高比縮放圖片
+            scaled_pixmap = pixmap.scaled(
+                self.thumbnail_label.size(),
+                Qt.KeepAspectRatio,
+                Qt.SmoothTransformation
+            )
+            self.thumbnail_label.setPixmap(scaled_pixmap)
+            self.log('縮略圖載入成功', 'debug')
+        else:
+            self.log('縮略圖格式不支援', 'debug')
+            self.thumbnail_label.setText('縮略圖格式不支援')
 
     def start_download(self):
         url_raw = self.url_input.text().strip()
@@ -1632,6 +4448,22 @@ class YTDLPDownloader(QMainWindow):
         if 'douyin.com' in url_raw.lower():
             QMessageBox.warning(self, '不支援抖音', '目前 1.05 版不支援抖音（Douyin）影片下載，請改用 TikTok 或其他平台。')
             return
+        # 播放清單中有選取的項目時，只下載選取的項目
+        selected_urls = self.get_selected_playlist_urls()
+        if selected_urls:
+            fmt = self.format_combo.currentText()
+            out_dir = self.path_input.text().strip() or self.default_download_dir
+            self.log(f'下載播放清單中選取的 {len(selected_urls)} 個項目', 'info')
+            self.download_playlist_entries(selected_urls, fmt, out_dir, self.quality_combo.currentText())
+            return
+        # 多 P 影片未選取分 P 時，全部分 P 各自加入佇列
+        part_urls = self.bilibili_parts.get(get_cache_key(url)) if 'bilibili.com' in url.lower() else None
+        if part_urls and not self.section_check.isChecked():
+            fmt = self.format_combo.currentText()
+            out_dir = self.path_input.text().strip() or self.default_download_dir
+            self.log(f'下載全部 {len(part_urls)} 個分 P', 'info')
+            self.download_playlist_entries(part_urls, fmt, out_dir, self.quality_combo.currentText())
+            return
         # YouTube/YouTube Music 必須有 v= 參數
         if ('youtube.com/watch' in url.lower()) and ('v=' not in url):
             QMessageBox.warning(self, '無效連結', '請輸入正確的 YouTube 或 YouTube Music 影片網址（需包含 v= 參數）')
@@ -1647,185 +4479,996 @@ class YTDLPDownloader(QMainWindow):
         if not url:
             self.log('請輸入影片網址', 'debug')
             return
-        self.download_btn.setEnabled(False)
-        threading.Thread(target=self.download_video, args=(url, fmt, out_dir, quality), daemon=True).start()
+        section = None
+        if self.section_check.isChecked():
+            section = self.get_download_section()
+            if section is None:
+                return
+            if '/live' in url.lower():
+                QMessageBox.warning(self, '提示', '直播無法只下載片段，請取消「只下載片段」')
+                return
+        self.enqueue_download(url, fmt, out_dir, quality, recipe=self.download_recipe, section=section)
+
+    def get_format_policy(self):
+        """目前選擇的格式策略名稱（任何執行緒皆可呼叫，讀取主執行緒更新的值）"""
+        return self.format_policy
+
+    def on_format_policy_changed(self):
+        """主執行緒：記錄新選擇的格式策略"""
+        self.format_policy = self.policy_combo.currentData() or 'editable'
+
+    def get_download_section(self):
+        """讀取片段下載的時間範圍，格式錯誤時提示並回傳 None"""
+        start_text = self.section_start_input.text().strip()
+        end_text = self.section_end_input.text().strip()
+        start = self.parse_time(start_text) if start_text else 0
+        end = self.parse_time(end_text) if end_text else None
+        if start is None or (end_text and end is None):
+            QMessageBox.warning(self, '警告', '時間格式錯誤，請使用 HH:MM:SS 或 HH:MM:SS.mmm 格式')
+            return None
+        if end is not None and end <= start:
+            QMessageBox.warning(self, '警告', '結束時間必須大於開始時間')
+            return None
+        if not start and end is None:
+            QMessageBox.warning(self, '警告', '請輸入片段的開始或結束時間')
+            return None
+        return DownloadSection(start, end, self.section_exact_check.isChecked())
+
+    def apply_post_recipe(self, recipe, saved_files, job=None):
+        """執行合併步驟無法涵蓋的下載後處理（每個檔案只額外處理一次），回傳是否全部成功"""
+        ok = True
+        for _, _, format_id, filepath in saved_files:
+            if recipe.can_fuse() and '+' in format_id:
+                # 已在合併步驟中完成
+                self.log(f'下載後處理已於合併時完成: {recipe.describe()}', 'info')
+                continue
+            command, outputs = recipe.build_command(filepath)
+            self.log(f'開始下載後處理（{recipe.describe()}）: {os.path.basename(filepath)}', 'info')
+            if job:
+                job.progress = '後處理中'
+                self.download_queue.notify(job)
+            errors = []
+            run_ffmpeg_command(
+                command,
+                lambda msg, level='debug': self.log(msg, 'debug'),
+                lambda output: self.log(f'下載後處理完成: {", ".join(outputs)}', 'info'),
+                errors.append
+            )
+            if errors:
+                self.log(f'下載後處理失敗: {errors[0]}', 'error')
+                ok = False
+        if job:
+            job.progress = '100%' if ok else '後處理失敗'
+        return ok
+
+    def record_archive(self, url, fmt, saved_files, title=None, recipe=None):
+        """將下載完成的檔案寫入下載紀錄；已被下載後處理改寫（裁剪、濾鏡）的檔案不記錄"""
+        if recipe:
+            altered = [item for item in saved_files if recipe.modifies_download(fmt, item[2])]
+            if altered:
+                self.log(f'檔案已套用下載後處理（{recipe.describe()}），不記入下載紀錄', 'debug')
+                saved_files = [item for item in saved_files if item not in altered]
+        for extractor, video_id, _, filepath in saved_files:
+            keys = {get_archive_key(url, extractor, video_id)}
+            url_key = get_archive_key(url)
+            if url_key and len(saved_files) == 1:
+                # 網址辨識的 ID 與 yt-dlp 回報的不同時（例如 Bilibili 分 P），兩者都記錄
+                keys.add(url_key)
+            try:
+                self.download_archive.add(sorted(keys), fmt, filepath, title)
+            except (OSError, sqlite3.Error) as e:
+                log_error(f"寫入下載紀錄失敗: {str(e)}")
+
+    def find_archived(self, url, fmt, extractor=None, video_id=None):
+        """查詢下載紀錄（不連網）：網址無法辨識 ID 時改用快取的影片資訊"""
+        key = get_archive_key(url, extractor, video_id)
+        if not key:
+            cached_info = self.info_cache.get(url)
+            if cached_info:
+                key = get_archive_key(url, cached_info.get('extractor_key'), cached_info.get('id'))
+        try:
+            return self.download_archive.lookup(key, fmt)
+        except sqlite3.Error as e:
+            log_error(f"查詢下載紀錄失敗: {str(e)}")
+            return None
+
+    def on_download_settings_changed(self):
+        """主執行緒：記錄下載相關選項，加入工作時寫入工作"""
+        self.use_aria2c = self.aria2c_action.isChecked()
+        self.live_segmented = self.live_segment_action.isChecked()
+        self.live_segment_audio = self.live_segment_audio_action.isChecked()
+
+    def apply_download_settings(self, job):
+        """將目前的下載選項寫入工作，執行時依工作上的值，不再讀取元件（任何執行緒皆可呼叫）"""
+        job.live_segment_minutes = self.live_segment_minutes if self.live_segmented else None
+        job.live_segment_audio = self.live_segment_audio
+        job.external_downloader = 'aria2c' if self.use_aria2c else None
+        return job
+
+    def enqueue_download(self, url, fmt, out_dir, quality='自動', priority=0, recipe=None, section=None, policy=None):
+        """將下載加入佇列，由佇列依同時下載數限制執行；已下載過的影片直接略過（片段下載不檢查）"""
+        existing = self.find_archived(url, fmt) if not section else None
+        if existing:
+            self.log(f'已有此影片，略過下載: {existing["path"]}', 'info')
+            return None
+        job = self.apply_download_settings(
+            DownloadJob(url, fmt, out_dir, quality, priority, recipe, section, policy or self.get_format_policy()))
+        self.download_queue.add_job(job)
+        self.log(f'已加入下載佇列 #{job.job_id}: {url}', 'info')
+        return job
+
+    def build_download_jobs(self, urls, fmt, out_dir, quality='自動', recipe=None, policy=None):
+        """為多個網址建立下載工作（與 enqueue_download 相同的檢查），回傳依網址順序的 (工作或 None, 已下載的紀錄)"""
+        policy = policy or self.get_format_policy()
+        results = []
+        for url in urls:
+            existing = self.find_archived(url, fmt)
+            if existing:
+                results.append((None, existing))
+            else:
+                results.append((self.apply_download_settings(DownloadJob(url, fmt, out_dir, quality, 0, recipe, None, policy)), None))
+        return results
+
+    def add_download_jobs(self, results):
+        """將 build_download_jobs 建立的工作一次加入佇列"""
+        jobs = [job for job, _ in results if job]
+        self.download_queue.add_many(jobs)
+        if jobs:
+            self.log(f'已加入下載佇列 {len(jobs)} 個工作', 'info')
+
+    def enqueue_downloads(self, urls, fmt, out_dir, quality='自動', recipe=None, policy=None):
+        """一次將多個網址加入下載佇列，回傳依網址順序的 (工作或 None, 已下載的紀錄)"""
+        results = self.build_download_jobs(urls, fmt, out_dir, quality, recipe, policy)
+        self.add_download_jobs(results)
+        return results
+
+    def edit_download_recipe(self):
+        """設定之後下載的影片要自動執行的處理（時間裁剪、空間裁剪、縮放、浮水印、字幕、抽出音訊）"""
+        recipe = self.download_recipe or PostRecipe()
+        dlg = QDialog(self)
+        dlg.setWindowTitle('下載後處理')
+        layout = QVBoxLayout(dlg)
+
+        def add_row(label, widget, button=None):
+            row = QHBoxLayout()
+            row.addWidget(QLabel(label))
+            row.addWidget(widget, 1)
+            if button:
+                row.addWidget(button)
+            layout.addLayout(row)
+
+        def browse(line_edit, title, file_filter):
+            path, _ = QFileDialog.getOpenFileName(dlg, title, '', file_filter)
+            if path:
+                line_edit.setText(path)
+
+        start_input = QLineEdit(self.format_time(recipe.trim_start * 1000, 'millisecond') if recipe.trim_start else '')
+        start_input.setPlaceholderText('HH:MM:SS 或 HH:MM:SS.mmm')
+        end_input = QLineEdit(self.format_time(recipe.trim_end * 1000, 'millisecond') if recipe.trim_end else '')
+        end_input.setPlaceholderText('HH:MM:SS 或 HH:MM:SS.mmm')
+        crop_input = QLineEdit(recipe.crop)
+        crop_input.setPlaceholderText('寬:高:x:y (例如 640:480:0:0)')
+        scale_combo = QComboBox()
+        scale_combo.addItems(['原始', '1920x1080', '1280x720', '854x480', '640x360'])
+        if recipe.scale:
+            scale_combo.setCurrentText(recipe.scale)
+        watermark_input = QLineEdit(recipe.watermark)
+        watermark_btn = QPushButton('選擇')
+        watermark_btn.clicked.connect(lambda: browse(watermark_input, '選擇浮水印圖片', '圖片檔案 (*.png *.jpg *.jpeg);;所有檔案 (*.*)'))
+        subtitles_input = QLineEdit(recipe.subtitles)
+        subtitles_btn = QPushButton('選擇')
+        subtitles_btn.clicked.connect(lambda: browse(subtitles_input, '選擇字幕檔', '字幕檔案 (*.srt *.ass);;所有檔案 (*.*)'))
+        audio_check = QCheckBox('另外輸出 MP3 音訊')
+        audio_check.setChecked(recipe.extract_audio)
+
+        add_row('開始時間:', start_input)
+        add_row('結束時間:', end_input)
+        add_row('空間裁剪:', crop_input)
+        add_row('解析度:', scale_combo)
+        add_row('浮水印:', watermark_input, watermark_btn)
+        add_row('燒入字幕:', subtitles_input, subtitles_btn)
+        layout.addWidget(audio_check)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel | QDialogButtonBox.Reset)
+        buttons.accepted.connect(dlg.accept)
+        buttons.rejected.connect(dlg.reject)
+        buttons.button(QDialogButtonBox.Reset).setText('清除')
+        buttons.button(QDialogButtonBox.Reset).clicked.connect(lambda: dlg.done(2))
+        layout.addWidget(buttons)
+
+        result = dlg.exec_()
+        if result == 2:
+            self.download_recipe = None
+        elif result == QDialog.Accepted:
+            start = self.parse_time(start_input.text().strip()) if start_input.text().strip() else None
+            end = self.parse_time(end_input.text().strip()) if end_input.text().strip() else None
+            if (start_input.text().strip() and start is None) or (end_input.text().strip() and end is None):
+                QMessageBox.warning(self, '警告', '時間格式錯誤，請使用 HH:MM:SS 或 HH:MM:SS.mmm 格式')
+                return
+            if start is not None and end is not None and end <= start:
+                QMessageBox.warning(self, '警告', '結束時間必須大於開始時間')
+                return
+            crop = crop_input.text().strip()
+            if crop and not self.validate_crop_params(crop):
+                QMessageBox.warning(self, '警告', '裁剪參數格式錯誤，請使用 寬:高:x:y 格式')
+                return
+            recipe = PostRecipe(
+                trim_start=start, trim_end=end, crop=crop,
+                scale='' if scale_combo.currentText() == '原始' else scale_combo.currentText(),
+                watermark=watermark_input.text().strip(), subtitles=subtitles_input.text().strip(),
+                extract_audio=audio_check.isChecked()
+            )
+            self.download_recipe = None if recipe.is_empty() else recipe
+        else:
+            return
+        description = self.download_recipe.describe() if self.download_recipe else '無'
+        self.recipe_label.setText(f'下載後處理: {description}')
+        self.log(f'下載後處理設定: {description}', 'info')
+
+    def import_urls_from_file(self):
+        """從文字檔（例如聊天紀錄匯出）批次匯入網址"""
+        path, _ = QFileDialog.getOpenFileName(self, '選擇文字檔', '', '文字檔 (*.txt *.csv *.html *.json);;所有檔案 (*)')
+        if not path:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                text = f.read()
+        except OSError as e:
+            QMessageBox.warning(self, '錯誤', f'無法讀取檔案：{e}')
+            return
+        self.bulk_import(text)
+
+    def import_urls_from_clipboard(self):
+        """從剪貼簿批次匯入網址"""
+        self.bulk_import(QApplication.clipboard().text())
+
+    def bulk_import(self, text):
+        """取出文字中所有網址並加入下載佇列，已下載過的略過"""
+        urls = extract_urls(text)
+        if not urls:
+            QMessageBox.information(self, '批次匯入', '沒有找到任何網址')
+            return
+        fmt = self.format_combo.currentText()
+        out_dir = self.path_input.text().strip() or self.default_download_dir
+        results = self.enqueue_downloads(urls, fmt, out_dir, self.quality_combo.currentText(), recipe=self.download_recipe)
+        added = sum(1 for job, _ in results if job)
+        self.log(f'批次匯入: 找到 {len(urls)} 個網址，加入佇列 {added} 個，已下載過略過 {len(urls) - added} 個', 'info')
+
+    def run_download_job(self, job):
+        """佇列工作的執行函式"""
+        return self.download_video(job.url, job.fmt, job.out_dir, job.quality, live_confirmed=job.live_confirmed, job=job)
+
+    def on_queue_job_changed(self, job):
+        """佇列工作改變：寫入工作紀錄，並交由主執行緒更新佇列畫面"""
+        try:
+            self.job_journal.record(job)
+        except sqlite3.Error as e:
+            log_error(f"寫入下載工作紀錄失敗: {str(e)}")
+        if job.group:
+            self.check_part_group(job.group)
+        QCoreApplication.instance().postEvent(self, QueueJobEvent(job))
+
+    def on_queue_jobs_added(self, jobs):
+        """一次加入多個工作：以單一交易寫入工作紀錄，並只通知主執行緒一次"""
+        try:
+            self.job_journal.record_many(jobs)
+        except sqlite3.Error as e:
+            log_error(f"寫入下載工作紀錄失敗: {str(e)}")
+        QCoreApplication.instance().postEvent(self, QueueJobsEvent(jobs))
+
+    def resume_journal_jobs(self):
+        """將上次未完成的工作重新加入佇列，yt-dlp 會由 .part 檔接續下載"""
+        try:
+            self.job_journal.prune()
+            jobs = self.job_journal.load_unfinished()
+        except sqlite3.Error as e:
+            log_error(f"讀取下載工作紀錄失敗: {str(e)}")
+            return
+        for job in jobs:
+            self.apply_download_settings(job)
+        self.download_queue.add_many(jobs)
+        if jobs:
+            self.log(f'接續上次未完成的下載: {len(jobs)} 個', 'info')
+
+    def refresh_queue_row(self, job):
+        """更新佇列表格中的一列（需在主執行緒呼叫）"""
+        if job.job_id not in self.download_queue.jobs:
+            return
+        row = self.queue_rows.get(job.job_id)
+        if row is None:
+            row = self.queue_table.rowCount()
+            self.queue_table.insertRow(row)
+            self.queue_rows[job.job_id] = row
+        fmt_text = job.fmt if job.quality == '自動' else f'{job.fmt} {job.quality}'
+        if job.section:
+            fmt_text += f' [{job.section.describe()}]'
+        values = [job.title, fmt_text, job.status, None, str(job.priority)]
+        for column, value in enumerate(values):
+            if value is None:
+                continue
+            item = QTableWidgetItem(value)
+            item.setData(Qt.UserRole, job.job_id)
+            self.queue_table.setItem(row, column, item)
+        self.update_queue_progress_bar(row, job)
+
+    def update_queue_progress_bar(self, row, job):
+        """更新工作的進度條"""
+        job.progress_dirty = False
+        bar = self.queue_table.cellWidget(row, 3)
+        if bar is None:
+            bar = QProgressBar()
+            bar.setRange(0, 1000)
+            bar.setTextVisible(True)
+            self.queue_table.setCellWidget(row, 3, bar)
+        progress = job.last_progress
+        if job.status in (DownloadJob.DONE, DownloadJob.TRANSCODING):
+            bar.setValue(1000)
+            bar.setFormat(job.progress or job.status)
+        elif progress is not None:
+            fraction = progress.fraction
+            bar.setValue(int(fraction * 1000) if fraction is not None else 0)
+            bar.setFormat(progress.describe())
+        else:
+            bar.setValue(0)
+            bar.setFormat(job.progress)
+
+    def refresh_queue_progress(self):
+        """定時刷新有新進度的工作（固定頻率，不隨進度回報次數增加）"""
+        for job_id, row in self.queue_rows.items():
+            job = self.download_queue.jobs.get(job_id)
+            if job and job.progress_dirty:
+                self.update_queue_progress_bar(row, job)
+
+    def refresh_queue_rows(self, jobs):
+        """一次更新多列（需在主執行緒呼叫），更新期間暫停重繪"""
+        self.queue_table.setUpdatesEnabled(False)
+        try:
+            for job in jobs:
+                self.refresh_queue_row(job)
+        finally:
+            self.queue_table.setUpdatesEnabled(True)
+
+    def rebuild_queue_table(self):
+        """依佇列內容重建表格"""
+        self.queue_table.setRowCount(0)
+        self.queue_rows.clear()
+        for job in list(self.download_queue.jobs.values()):
+            self.refresh_queue_row(job)
+
+    def get_selected_job_ids(self):
+        rows = {index.row() for index in self.queue_table.selectedIndexes()}
+        return [self.queue_table.item(row, 0).data(Qt.UserRole) for row in sorted(rows) if self.queue_table.item(row, 0)]
+
+    def pause_selected_jobs(self):
+        for job_id in self.get_selected_job_ids():
+            self.download_queue.pause(job_id)
+
+    def resume_selected_jobs(self):
+        for job_id in self.get_selected_job_ids():
+            self.download_queue.resume(job_id)
+
+    def cancel_selected_jobs(self):
+        for job_id in self.get_selected_job_ids():
+            self.download_queue.cancel(job_id)
+
+    def raise_selected_jobs_priority(self):
+        for job_id in self.get_selected_job_ids():
+            job = self.download_queue.jobs.get(job_id)
+            if job:
+                self.download_queue.set_priority(job_id, job.priority + 1)
+        self.download_queue.schedule()
+
+    def clear_finished_jobs(self):
+        removed = self.download_queue.remove_finished()
+        for job in removed:
+            self.job_journal.remove(job)
+        if removed:
+            self.rebuild_queue_table()
+
+    def update_queue_limits(self):
+        self.download_queue.set_limits(self.max_concurrent_spin.value(), self.per_host_spin.value())
 
     def is_tiktok_live(self, url):
+        """以 yt-dlp 確認是否直播中，回傳 True/False；探測失敗等無法判斷的情況回傳 None"""
+        # 直播狀態快取時間很短（見 INFO_CACHE_TTL['tiktok_live']），避免連續點擊重複探測
+        cached_info = self.info_cache.get(url)
+        if cached_info is not None and 'is_live' in cached_info:
+            return bool(cached_info['is_live'])
         try:
-            cmd = ['yt-dlp', '--no-cache-dir', '--extractor-args', 'tiktok:api_hostname=api22-normal-c-useast1a.tiktokv.com',
+            cmd = ['yt-dlp', '--extractor-args', 'tiktok:api_hostname=api22-normal-c-useast1a.tiktokv.com',
                    '--extractor-args', 'tiktok:app_version=22.1.3', '--extractor-args', 'tiktok:device_id=7163339161873573377',
                    '--extractor-args', 'tiktok:manifest_app_version=22.1.3', '--extractor-args', 'tiktok:api_url=https://api22-normal-c-useast1a.tiktokv.com/passport/web/user/query/',
-                   '--extractor-args', 'tiktok:api_key=aweme_v3_web', '--skip-download', url]
+                   '--extractor-args', 'tiktok:api_key=aweme_v3_web', '--dump-json', url]
             
-            creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                creationflags=creationflags
-            )
-            output, _ = proc.communicate(timeout=20)
-            return "The channel is not currently live" not in output
+            video_info, error = self.ytdlp_engine.dump_json(cmd, timeout=20)
+            if "The channel is not currently live" in (error or ''):
+                self.info_cache.put(url, {'is_live': False, 'webpage_url': url})
+                return False
+            if not video_info:
+                self.log(f'檢查直播狀態失敗: {error}', 'debug')
+                return None
+            self.info_cache.put(url, video_info)
+            # 只有 yt-dlp 明確回報直播中才算開播
+            return video_info.get('is_live')
         except Exception as e:
             self.log(f'檢查直播狀態失敗: {e}', 'debug')
-            return False
+            return None
+
+    def check_tiktok_live_status(self, url):
+        """直播監看使用的檢查：先讀取直播頁，無法判斷時才以 yt-dlp 確認；仍無法判斷時回傳 None"""
+        live = check_tiktok_live_page(url)
+        if live is None:
+            self.info_cache.invalidate(url)
+            live = self.is_tiktok_live(url)
+        return live
+
+    def start_live_watcher(self):
+        """載入監看清單並啟動直播監看執行緒"""
+        self.live_watch_file = os.path.join(get_data_dir(), 'live_watch.json')
+        self.live_watcher = TikTokLiveWatcher(self.check_tiktok_live_status)
+        self.live_watcher.status_changed.connect(self.on_live_status_changed)
+        self.live_watcher.check_failed.connect(lambda url, error: self.log(f'檢查直播狀態失敗 {url}: {error}', 'debug'))
+        try:
+            with open(self.live_watch_file, 'r', encoding='utf-8') as f:
+                for url in json.load(f):
+                    self.live_watcher.add_url(url)
+        except (OSError, ValueError):
+            pass
+        self.live_watcher.start()
+
+    def edit_live_watch_list(self):
+        """編輯直播監看清單（每行一個 TikTok 直播網址）"""
+        text, ok = QInputDialog.getMultiLineText(
+            self, '直播監看清單', '每行一個 TikTok 直播網址（如 https://www.tiktok.com/@用戶名/live）：',
+            '\n'.join(self.live_watcher.urls()))
+        if not ok:
+            return
+        urls = []
+        for line in text.splitlines():
+            url = extract_url(line.strip())
+            if 'tiktok.com' in url.lower() and '/live' in url.lower() and url not in urls:
+                urls.append(url)
+        for url in self.live_watcher.urls():
+            if url not in urls:
+                self.live_watcher.remove_url(url)
+        for url in urls:
+            self.live_watcher.add_url(url)
+        try:
+            with open(self.live_watch_file, 'w', encoding='utf-8') as f:
+                json.dump(urls, f, ensure_ascii=False)
+        except OSError as e:
+            self.log(f'儲存直播監看清單失敗: {e}', 'debug')
+        self.log(f'直播監看清單: {len(urls)} 個頻道', 'info')
+
+    def edit_sync_sources(self):
+        """編輯同步來源（每行一個頻道或播放清單網址），新增的來源使用目前的格式、畫質、用途與下載資料夾"""
+        text, ok = QInputDialog.getMultiLineText(
+            self, '同步來源清單', '每行一個頻道或播放清單網址（同步時只下載上次同步之後的新影片）：',
+            '\n'.join(self.sync_sources.urls()))
+        if not ok:
+            return
+        urls = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            url = get_sync_source_url(line.strip())
+            if is_playlist_url(url) and url not in urls:
+                urls.append(url)
+            elif url not in urls:
+                self.log(f'不是頻道或播放清單網址，略過: {line.strip()}', 'info')
+        for url in self.sync_sources.urls():
+            if url not in urls:
+                self.sync_sources.remove(url)
+        fmt = self.format_combo.currentText()
+        out_dir = self.path_input.text().strip() or self.default_download_dir
+        for url in urls:
+            if self.sync_sources.get(url) is None:
+                self.sync_sources.add(url, fmt, out_dir, self.quality_combo.currentText(), self.get_format_policy())
+        self.log(f'同步來源: {len(urls)} 個', 'info')
+
+    def sync_due_sources(self):
+        """每日自動同步：同步超過一天未同步的來源"""
+        if self.auto_sync_action.isChecked():
+            self.sync_all_sources(self.sync_sources.due(86400))
+
+    def sync_all_sources(self, urls=None):
+        """在背景依序同步來源（預設為全部）"""
+        urls = self.sync_sources.urls() if urls is None else urls
+        if not urls:
+            return
+        def run():
+            for url in urls:
+                self.sync_source(url)
+        threading.Thread(target=run, daemon=True).start()
+
+    def sync_source(self, url, stop_after_known=3):
+        """增量同步一個來源，只將新發現的項目與先前未完成的項目加入佇列
+
+        由新到舊的頻道逐筆讀取清單（--lazy-playlist），遇到高水位或連續數個已下載的項目就停止，
+        頻道影片再多也只需讀取清單的第一頁；其他播放清單新項目加在最後，需讀完清單並以已見過的 ID 判斷。
+        """
+        state = self.sync_sources.get(url)
+        if not state or url in self.syncing_sources:
+            return
+        self.syncing_sources.add(url)
+        try:
+            started = time.time()
+            fmt = state['fmt']
+            newest_first = is_newest_first_feed(url)
+            seen = set(state.get('seen') or [])
+            pending = dict(state.get('pending') or {})  # 項目 ID（無 ID 時為網址）-> [網址, ie_key]
+            cmd = ['yt-dlp', '--flat-playlist', '--lazy-playlist', '--dump-json', url]
+            self.log(f'開始同步: {url}', 'info')
+            new_entries = []
+            newest_id = newest_date = None
+            known = scanned = 0
+            stop_reason = '已讀完清單'
+            for entry in self.ytdlp_engine.iter_flat_entries(cmd):
+                entry_url = get_entry_url(entry)
+                if not entry_url:
+                    continue
+                scanned += 1
+                entry_id, entry_date = entry.get('id'), get_entry_date(entry)
+                if newest_first:
+                    newest_id = newest_id or entry_id
+                    newest_date = max(newest_date or '', entry_date or '') or None
+                    if entry_id and entry_id == state['last_id']:
+                        stop_reason = '到達上次同步的位置'
+                        break
+                    if entry_date and state['last_date'] and entry_date < state['last_date']:
+                        stop_reason = f'項目早於上次同步的日期 {state["last_date"]}'
+                        break
+                elif entry_id:
+                    if entry_id in seen:
+                        continue
+                    seen.add(entry_id)
+                if self.find_archived(entry_url, fmt, entry.get('ie_key'), entry_id):
+                    if newest_first:
+                        # 與 --break-on-existing 相同，但容許少數重新排序的項目
+                        known += 1
+                        if known >= stop_after_known:
+                            stop_reason = f'連續 {known} 個項目已下載'
+                            break
+                    continue
+                known = 0
+                if (entry_id or entry_url) not in pending:
+                    new_entries.append((entry_id or entry_url, entry_url, entry.get('ie_key')))
+
+            # 先前加入佇列但失敗、被取消或被移除的項目再加入一次；已下載的不再追蹤
+            active_urls = self.download_queue.active_urls()
+            retried = 0
+            for key, (entry_url, ie_key) in list(pending.items()):
+                if self.find_archived(entry_url, fmt, ie_key, key if key != entry_url else None):
+                    del pending[key]
+                elif entry_url not in active_urls:
+                    self.enqueue_download(entry_url, fmt, state['out_dir'], state.get('quality', '自動'),
+                                          policy=state.get('policy'))
+                    retried += 1
+            # 依上傳順序（由舊到新）加入佇列
+            for key, entry_url, ie_key in (reversed(new_entries) if newest_first else new_entries):
+                pending[key] = [entry_url, ie_key]
+                self.enqueue_download(entry_url, fmt, state['out_dir'], state.get('quality', '自動'),
+                                      policy=state.get('policy'))
+
+            fields = {'last_sync': time.time(), 'pending': pending}
+            if newest_first:
+                if newest_id:
+                    fields['last_id'] = newest_id
+                if newest_date and newest_date > (state['last_date'] or ''):
+                    fields['last_date'] = newest_date
+            else:
+                fields['seen'] = sorted(seen)
+            self.sync_sources.update(url, **fields)
+            self.log(f'同步完成: {url}，新項目 {len(new_entries)} 個、重試 {retried} 個（讀取 {scanned} 個，{stop_reason}，'
+                     f'{time.time() - started:.1f}s）', 'info')
+        except Exception as e:
+            self.log(f'同步失敗 {url}: {str(e)}', 'error')
+        finally:
+            self.syncing_sources.discard(url)
+
+    def on_live_status_changed(self, url, live):
+        """直播狀態改變：開播時依設定自動開始錄製"""
+        if not live:
+            self.log(f'直播已結束或尚未開始: {url}', 'info')
+            return
+        self.log(f'偵測到開播: {url}', 'info')
+        # 同一頻道同時只錄製一份；錄製經由佇列執行，可在佇列中取消並受同時下載數限制
+        if not self.live_auto_record_action.isChecked() or url in self.download_queue.active_urls():
+            return
+        out_dir = self.path_input.text().strip() or self.default_download_dir
+        job = self.apply_download_settings(DownloadJob(url, 'mp4', out_dir, policy=self.get_format_policy()))
+        job.live_confirmed = True
+        self.download_queue.add_job(job)
+        self.log(f'已加入下載佇列 #{job.job_id}: {url}', 'info')
+
+    def set_live_segment_minutes(self):
+        """設定直播分段錄製每段的長度"""
+        minutes, ok = QInputDialog.getInt(self, '直播分段長度', '每段長度（分鐘）：', self.live_segment_minutes, 1, 600)
+        if ok:
+            self.live_segment_minutes = minutes
+            self.log(f'直播分段長度: {minutes} 分鐘', 'info')
+
+    def record_live_segmented(self, url, out_dir, job):
+        """分段錄製直播，每完成一段立即可用，並可在錄製途中進行後處理（分段長度與抽音訊設定取自工作）"""
+        # 與一般直播下載相同，從直播開頭錄製，不遺漏開始錄製前的內容
+        ytdlp_args = TIKTOK_DOWNLOAD_ARGS + ['--live-from-start'] if 'tiktok.com' in url.lower() else []
+        recorder = SegmentedLiveRecorder(
+            url, out_dir, job.live_segment_minutes,
+            ytdlp_args=ytdlp_args,
+            on_segment=lambda path: self.on_live_segment(path, job.live_segment_audio),
+            on_line=lambda line: self.log(line, 'debug')
+        )
+        self.log(f'開始分段錄製直播（每段 {job.live_segment_minutes} 分鐘）: {url}', 'info')
+        job.progress = '分段錄製中'
+        self.download_queue.notify(job)
+        segments = recorder.run(job.token)
+        self.log(f'直播錄製結束，共 {len(segments)} 段', 'info')
+        job.progress = f'{len(segments)} 段'
+        return bool(segments)
+
+    def on_live_segment(self, path, extract_audio=False):
+        """直播分段完成（在錄製執行緒中呼叫）：依工作設定在背景抽出音訊"""
+        self.log(f'直播分段完成: {path}', 'info')
+        if not extract_audio:
+            return
+        command = ['ffmpeg', '-y', '-i', path, '-vn', '-c:a', 'libmp3lame', '-q:a', '2', os.path.splitext(path)[0] + '.mp3']
+        threading.Thread(
+            target=run_ffmpeg_command,
+            args=(command, lambda msg, level='debug': self.log(msg, 'debug')),
+            kwargs={'on_complete': lambda output: self.log(f'分段音訊完成: {os.path.basename(path)}', 'info')},
+            daemon=True
+        ).start()
 
     def is_instagram_profile(self, url):
         # Remove query parameters and check if it's a profile URL
         clean_url = url.split('?')[0]
         return 'instagram.com/' in clean_url and not any(x in clean_url for x in ['/p/', '/reel/', '/tv/', '/stories/'])
 
-    def download_video(self, url, fmt, out_dir, quality='自動'):
+    def download_video(self, url, fmt, out_dir, quality='自動', live_confirmed=False, job=None, policy=None):
+        """執行一次下載，回傳是否成功；由佇列呼叫時 job 用於回報進度與取消
+
+        policy 為格式策略，由主執行緒在加入或開始下載時決定（有 job 時使用 job.policy）。
+        """
         url = extract_url(url)
+        policy = job.policy if job else (policy or 'editable')
         self.log(f'開始下載: {url} ({fmt}, {quality})', 'debug')
+        reservation = None
+        if job:
+            cached_info = self.info_cache.get(url)
+            if cached_info and cached_info.get('title'):
+                job.title = cached_info['title']
+                self.download_queue.notify(job)
         try:
             ffmpeg_path = get_ffmpeg_path()
             if not check_ffmpeg():
-                self.log('找不到 ffmpeg，請檢查 ffmpeg 目錄或安裝路徑', 'debug')
-                QMessageBox.critical(self, '錯誤', '請先安裝 ffmpeg\n\n下載網址：https://ffmpeg.org/download.html\n\n安裝後請重新啟動程式')
-                self.download_btn.setEnabled(True)
-                return
+                # 在背景執行緒中，不可顯示對話框，改由佇列進度與紀錄回報
+                self.log('找不到 ffmpeg，請先安裝 ffmpeg（https://ffmpeg.org/download.html）後重新啟動程式', 'error')
+                if job:
+                    job.progress = '找不到 ffmpeg'
+                return False
 
             # 檢查是否是 Instagram 個人檔案
             if self.is_instagram_profile(url):
-                self.log('不支援直接下載 Instagram 個人檔案，請使用特定貼文、限時動態或 Reels 的網址', 'debug')
-                QMessageBox.warning(self, '提示', '不支援直接下載 Instagram 個人檔案\n\n請使用以下格式的網址：\n- 貼文：https://www.instagram.com/p/XXXXX/\n- Reels：https://www.instagram.com/reel/XXXXX/\n- 限時動態：https://www.instagram.com/stories/XXXXX/')
-                self.download_btn.setEnabled(True)
-                return
+                self.log('不支援直接下載 Instagram 個人檔案，請使用特定貼文、限時動態或 Reels 的網址', 'error')
+                if job:
+                    job.progress = '不支援個人檔案'
+                return False
+
+            # 已下載過的影片不再連網下載（直播每次內容不同、片段不是完整影片，不檢查）
+            section = job.section if job else None
+            if '/live' not in url.lower() and not section:
+                existing = self.find_archived(url, fmt)
+                if existing:
+                    self.log(f'已有此影片，略過下載: {existing["path"]}', 'info')
+                    if job:
+                        job.progress = '已有檔案'
+                        job.saved_files = [existing['path']]
+                    return True
 
             # 檢查是否是 TikTok 直播
             is_tiktok_live = '/live' in url.lower() and 'tiktok.com' in url.lower()
-            if is_tiktok_live:
-                if not self.is_tiktok_live(url):
-                    self.log('該頻道目前沒有在直播', 'debug')
-                    QMessageBox.warning(self, '提示', '該頻道目前沒有在直播，請等待直播開始後再試。')
-                    self.download_btn.setEnabled(True)
-                    return
-                else:
-                    self.log('偵測到 TikTok 直播，將下載直播串流。', 'info')
-                    QMessageBox.information(self, '提示', '偵測到 TikTok 直播，將下載直播串流。')
+            if is_tiktok_live and live_confirmed:
+                self.log('直播監看偵測到開播，開始錄製直播串流。', 'info')
+            elif is_tiktok_live:
+                live = self.is_tiktok_live(url)
+                if live is None:
+                    self.log(f'無法確認該頻道是否正在直播，請稍後再試: {url}', 'error')
+                    if job:
+                        job.progress = '無法確認直播狀態'
+                    return False
+                if not live:
+                    self.log(f'該頻道目前沒有在直播，請等待直播開始後再試: {url}', 'error')
+                    if job:
+                        job.progress = '沒有在直播'
+                    return False
+                self.log('偵測到 TikTok 直播，將下載直播串流。', 'info')
+            if is_tiktok_live and job and job.live_segment_minutes:
+                return self.record_live_segmented(url, out_dir, job)
+
+            recipe = job.recipe if job and job.recipe and not job.recipe.is_empty() else None
+            if not is_tiktok_live:
+                # 直播的大小無法預估，其餘下載先預留磁碟空間
+                admission, reservation = self.admit_download(url, fmt, out_dir, quality, recipe, job, policy)
+                if admission == DiskSpaceManager.WAIT and job:
+                    return DownloadQueueManager.DEFERRED
+                if admission != DiskSpaceManager.OK:
+                    return False
 
             is_tiktok = 'tiktok.com' in url.lower()
             output_template = f'{out_dir}/%(title)s.%(ext)s'
             if is_tiktok:
                 output_template = f'{out_dir}/%(title)s_%(upload_date)s_%(id)s.%(ext)s'
-
-            base_cmd = ['yt-dlp', '--no-cache-dir']
+            if section:
+                # 片段檔名加上時間範圍，不覆蓋完整影片或其他片段
+                output_template = output_template[:-len('.%(ext)s')] + f'_{section.suffix()}.%(ext)s'
+            if job and job.output_template:
+                # 續傳時沿用原本的輸出樣板，才能找到同一個 .part 檔
+                output_template = job.output_template
+
+            # 下載完成後輸出最終檔案路徑，用於寫入下載紀錄（--print 會隱含 --quiet，需另外保留進度輸出）
+            base_cmd = ['yt-dlp',
+                        '--print', 'after_move:GXTRO_FILE %(extractor_key)s\t%(id)s\t%(format_id)s\t%(filepath)s', '--progress']
+            # 進度以 JSON 逐行輸出，解析後驅動佇列的進度條
+            base_cmd.extend(PROGRESS_ARGS)
+            if section:
+                base_cmd.extend(section.ytdlp_args())
+                self.log(f'只下載片段: {section.describe()}', 'info')
 
             if is_tiktok:
-                base_cmd.extend([
-                    '--extractor-args', 'tiktok:api_hostname=api22-normal-c-useast1a.tiktokv.com',
-                    '--extractor-args', 'tiktok:app_version=22.1.3',
-                    '--extractor-args', 'tiktok:device_id=7163339161873573377',
-                    '--extractor-args', 'tiktok:manifest_app_version=22.1.3',
-                    '--extractor-args', 'tiktok:api_url=https://api22-normal-c-useast1a.tiktokv.com/passport/web/user/query/',
-                    '--extractor-args', 'tiktok:api_key=aweme_v3_web',
-                    '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
-                    '--no-check-certificate'
-                ])
+                base_cmd.extend(TIKTOK_DOWNLOAD_ARGS)
                 if is_tiktok_live:
                     base_cmd.append('--live-from-start')
 
+            # 依網站加入分段下載參數（連線數會依過去的下載速度自動調整）
+            fragments = self.site_tuner.fragments_for(url)
+            base_cmd.extend(self.site_tuner.args_for(url, job.external_downloader if job else None))
+
             # 根據設定決定是否嵌入封面圖和作者資訊
             # if self.embed_thumbnail_action.isChecked():
             #     base_cmd.append('--embed-thumbnail')
             if self.embed_metadata_action.isChecked():
                 base_cmd.append('--embed-metadata')
 
-            if fmt == 'mp3':
-                cmd = base_cmd + [
-                    '-x', '--audio-format', 'mp3',
-                    '-o', output_template, url
-                ]
+            # 佇列中的 MP3 分兩階段：這裡只下載原始音訊，轉檔交給轉檔工作池，下載名額立即給下一個工作
+            pipelined = fmt == 'mp3' and job is not None and not is_tiktok_live
+            # 下載後處理：能放進 yt-dlp 合併／抽音訊步驟的部分直接在該步驟完成，不另外重寫檔案
+            if pipelined:
+                cmd = base_cmd + ['-f', 'bestaudio/best', '-o', output_template, url]
+            elif fmt in AUDIO_FORMATS:
+                # 保留原始音訊時 --audio-format best 只換容器，不重新編碼
+                cmd = base_cmd + ['-x', '--audio-format', 'mp3' if fmt == 'mp3' else 'best']
+                fused_args = recipe.fused_postprocessor_args(fmt) if recipe else None
+                if fused_args:
+                    cmd += ['--postprocessor-args', fused_args]
+                cmd += ['-o', output_template, url]
             else:
-                if quality and quality != '自動':
-                    format_id = self.get_format_id_by_quality(url, quality)
-                    if format_id:
-                        cmd = base_cmd + [
-                            '-f', format_id,
-                            '--merge-output-format', 'mp4',
-                            '--postprocessor-args', 'ffmpeg:-c:v copy -c:a copy',
-                            '-o', output_template, url
-                        ]
-                    else:
-                        self.log(f'找不到對應畫質 {quality}，將自動選擇', 'debug')
-                        cmd = base_cmd + [
-                            '-f', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best',
-                            '--merge-output-format', 'mp4',
-                            '--postprocessor-args', 'ffmpeg:-c:v copy -c:a copy',
-                            '-o', output_template, url
-                        ]
+                format_selector = job.format_selector if job else None
+                if format_selector:
+                    self.log(f'沿用先前選定的格式: {format_selector}', 'debug')
                 else:
-                    cmd = base_cmd + [
-                        '-f', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best',
-                        '--merge-output-format', 'mp4',
-                        '--postprocessor-args', 'ffmpeg:-c:v copy -c:a copy',
-                        '-o', output_template, url
-                    ]
+                    format_selector = self.get_format_selector(url, quality, policy)
+                    if job and job.group:
+                        # 要合併的分 P 使用相同格式，串接時編碼與解析度才會一致
+                        format_selector = job.group.pin_format(format_selector)
+                cmd = base_cmd + [
+                    '-f', format_selector,
+                    '--merge-output-format', 'mp4',
+                    '--postprocessor-args', 'ffmpeg:-c:v copy -c:a copy'
+                ]
+                if recipe and recipe.can_fuse():
+                    # 較明確的 Merger 參數優先於上面的 ffmpeg 參數
+                    cmd += ['--postprocessor-args', recipe.fused_postprocessor_args('mp4')]
+                cmd += ['-o', output_template, url]
+                if job:
+                    job.format_selector = format_selector
+
+            if job:
+                # 寫入工作紀錄，當機後可用相同的樣板與格式接續
+                job.output_template = output_template
+                self.download_queue.notify(job)
+
+            # 已探測過的影片直接載入快取的 info-dict，不再重複解析網頁
+            info_json = self.get_fresh_info_json(url) if not is_tiktok_live else None
+            if info_json:
+                cmd = cmd[:-1] + ['--load-info-json', info_json]
+                self.log('使用快取的影片資訊下載（--load-info-json）', 'debug')
 
             self.log(f'執行下載命令: {cmd}', 'debug')
             env = os.environ.copy()
             if ffmpeg_path != "ffmpeg":
                 env["PATH"] = os.path.dirname(ffmpeg_path) + os.pathsep + env["PATH"]
 
-            creationflags = 0
-            if sys.platform == "win32":
-                creationflags = subprocess.CREATE_NO_WINDOW
-
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                env=env,
-                creationflags=creationflags
-            )
-
-            for line in proc.stdout:
-                line = line.strip()
-                if '%' in line or 'Downloading' in line or 'ETA' in line:
-                    self.log(line, 'info')
-                else:
-                    self.log(line, 'debug')
-            proc.wait()
+            # 統計下載量與是否被限流，用於調整該網站的連線數
+            # bytes 為已完成檔案的大小（磁碟預留用）；transferred／seconds 只計算本次實際傳輸的位元組與下載中的時間，
+            # 不含解析、合併，也不含續傳前已存在的部分
+            stats = {'bytes': 0, 'transferred': 0, 'seconds': 0.0, 'throttled': False, 'forbidden': False}
+            samples = {}  # 檔名 -> 上一筆進度的 (已下載位元組, 時間)
+            saved_files = []
+
+            def on_line(line):
+                if line.startswith('GXTRO_FILE '):
+                    extractor, video_id, format_id, filepath = line[len('GXTRO_FILE '):].split('\t', 3)
+                    saved_files.append((extractor, video_id, format_id, filepath))
+                    self.log(f'已儲存: {filepath}', 'info')
+                    return
+                if 'HTTP Error 429' in line or 'HTTP Error 403' in line:
+                    stats['throttled'] = True
+                    stats['forbidden'] = stats['forbidden'] or 'HTTP Error 403' in line
+                self.log(line, 'info' if 'Downloading' in line or line.startswith('ERROR') else 'debug')
+
+            last_log_time = [0.0]
+            last_journal_time = [time.time()]
+            def on_progress(progress):
+                # 進度只更新工作資料，畫面由定時器以固定頻率刷新
+                now = time.time()
+                last = samples.get(progress.filename)
+                if last and progress.downloaded >= last[0]:
+                    stats['transferred'] += progress.downloaded - last[0]
+                    stats['seconds'] += now - last[1]
+                samples[progress.filename] = (progress.downloaded, now) if progress.status == 'downloading' else None
+                if progress.status == 'finished':
+                    stats['bytes'] += progress.total or progress.downloaded
+                    self.log(f'檔案下載完成: {os.path.basename(progress.filename)}', 'info')
+                if reservation:
+                    # 已寫入磁碟的部分不再重複預留
+                    reservation.written = stats['bytes'] + (0 if progress.status == 'finished' else progress.downloaded)
+                if job:
+                    job.last_progress = progress
+                    job.progress_dirty = True
+                    job.bytes_done = progress.downloaded
+                    if time.time() - last_journal_time[0] >= 5:
+                        last_journal_time[0] = time.time()
+                        self.download_queue.notify(job)
+                elif time.time() - last_log_time[0] >= 5:
+                    # 沒有佇列畫面時（例如自動錄製直播）定期寫入日誌
+                    last_log_time[0] = time.time()
+                    self.log(f'[download] {progress.describe()}', 'info')
 
-            if proc.returncode == 0:
+            while True:
+                # 佇列中的下載共用頻寬額度；直播重新啟動會中斷錄製，不納入分配
+                lease = self.bandwidth.acquire() if job and not is_tiktok_live else None
+                try:
+                    returncode = self.ytdlp_engine.run(cmd, on_line, on_progress, env=env,
+                                                       token=job.token if job else None, bandwidth=lease)
+                finally:
+                    if lease:
+                        self.bandwidth.release(lease)
+                if returncode == 0 or not (info_json and stats['forbidden']) or (job and job.token.cancelled):
+                    break
+                # 快取中的簽章網址被拒（通常是已過期），改由網址重新解析再試一次
+                self.log('快取的串流網址已失效（HTTP 403），重新解析後再試一次', 'info')
+                self.info_cache.invalidate(url)
+                self.format_indexes.pop(get_cache_key(url), None)
+                cmd = cmd[:-2] + [url]
+                info_json = None
+                stats.update(bytes=0, transferred=0, seconds=0.0, throttled=False, forbidden=False)
+                samples.clear()
+                saved_files.clear()
+
+            if job and job.token.cancelled:
+                self.log(f'下載已中止: {url}', 'info')
+                return False
+            if returncode == 0 or stats['throttled']:
+                new_fragments = self.site_tuner.record(url, fragments, stats['transferred'], stats['seconds'], stats['throttled'])
+                if new_fragments and new_fragments != fragments:
+                    self.log(f'{get_site_name(url)} 分段下載連線數調整為 {new_fragments}', 'debug')
+            if returncode == 0 and pipelined:
+                self.log('下載完成，等待轉成 MP3', 'debug')
+                job.progress = '等待轉檔'
+                self.transcode_pool.submit(self.transcode_job_audio, job, url, list(saved_files), recipe, reservation)
+                reservation = None  # 由轉檔階段釋放
+                return DownloadQueueManager.HANDOFF
+            if returncode == 0:
                 self.log('下載完成！', 'debug')
-            else:
-                self.log('下載失敗。', 'debug')
+                if job:
+                    job.progress = '100%'
+                    job.saved_files = [filepath for _, _, _, filepath in saved_files]
+                if not is_tiktok_live and not section:
+                    self.record_archive(url, fmt, saved_files, job.title if job else None, recipe)
+                if recipe and fmt not in AUDIO_FORMATS:
+                    # 下載本身已完成並記錄，後處理失敗時工作仍標示為失敗，讓使用者知道輸出不完整
+                    return self.apply_post_recipe(recipe, saved_files, job)
+                return True
+            self.log('下載失敗。', 'debug')
+            # 快取的資訊可能已失效（例如串流網址過期），下次重新取得
+            self.info_cache.invalidate(url)
+            self.format_indexes.pop(get_cache_key(url), None)
         except Exception as e:
             self.log(f'下載錯誤: {e}', 'debug')
             self.log(traceback.format_exc(), 'debug')
         finally:
-            self.download_btn.setEnabled(True)
+            if reservation:
+                self.disk_space.release(reservation)
+        return False
 
-    def get_format_id_by_quality(self, url, quality):
-        url = extract_url(url)
+    def transcode_job_audio(self, job, url, saved_files, recipe=None, reservation=None):
+        """轉檔階段（在轉檔工作池中執行）：將下載的原始音訊轉成 MP3，完成後結束佇列工作"""
+        ok = False
         try:
-            cmd = ['yt-dlp', '-F', url]
-            proc = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
-            )
-            output, _ = proc.communicate(timeout=20)
-            
-            # 解析輸出以找到對應的格式 ID
-            for line in output.splitlines():
-                if quality in line and re.search(r'^\s*\d+\s', line):
-                    return line.split()[0]
-                # 對於 TikTok，我們需要特別處理格式 ID
-                if 'tiktok.com' in url.lower():
-                    if 'h264' in line and quality in line:
-                        return line.split()[0]
-                    if 'bytevc1' in line and quality in line:
-                        return line.split()[0]
-        except Exception as e:
-            self.log(f'畫質對應查詢失敗: {e}', 'debug')
-            print(e)
+            if job.token.cancelled:
+                return
+            job.progress = '轉檔中'
+            self.download_queue.notify(job)
+            trim_args = recipe.trim_args() if recipe else []
+            for i, (extractor, video_id, format_id, filepath) in enumerate(saved_files):
+                output_path = os.path.splitext(filepath)[0] + '.mp3'
+                # 來源本身就是 MP3 時先寫到暫存檔再取代
+                target = output_path + '.tmp.mp3' if output_path == filepath else output_path
+                result = {}
+                command = [get_ffmpeg_path(), '-y', '-i', filepath, '-vn', '-map_metadata', '0'] + trim_args + [
+                    '-c:a', 'libmp3lame', '-q:a', '2', target]
+                run_ffmpeg_command(
+                    command,
+                    lambda msg, level='debug': self.log(msg, 'debug'),
+                    lambda output: result.update(ok=True),
+                    lambda error: result.update(error=error)
+                )
+                if not result.get('ok'):
+                    self.log(f'轉成 MP3 失敗: {result.get("error")}', 'error')
+                    return
+                if target != output_path:
+                    os.replace(target, output_path)
+                else:
+                    os.remove(filepath)
+                saved_files[i] = (extractor, video_id, format_id, output_path)
+                self.log(f'已轉成 MP3: {output_path}', 'info')
+            job.saved_files = [filepath for _, _, _, filepath in saved_files]
+            if not job.section:
+                self.record_archive(url, job.fmt, saved_files, job.title, recipe)
+            job.progress = '100%'
+            ok = True
+        except OSError as e:
+            self.log(f'轉成 MP3 失敗: {e}', 'error')
+        finally:
+            if reservation:
+                self.disk_space.release(reservation)
+            self.download_queue.finish(job, ok)
+
+    def admit_download(self, url, fmt, out_dir, quality, recipe=None, job=None, policy='editable'):
+        """依影片資訊估計所需空間並預留，回傳 (DiskSpaceManager 狀態, 預留)"""
+        info = self.get_video_info(url) or {}
+        index = self.get_format_index(url, info) if info else None
+        estimate = estimate_download_size(info, index, fmt, quality, recipe, policy)
+        if job and job.section:
+            estimate = int(estimate * job.section.fraction(info.get('duration')))
+        if job:
+            # 續傳時 .part 檔已佔用的部分不需再預留
+            estimate = max(0, estimate - job.bytes_done)
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            status, reservation, available = self.disk_space.reserve(out_dir, estimate, url)
+        except OSError as e:
+            self.log(f'無法檢查磁碟空間，略過空間檢查: {e}', 'debug')
+            return DiskSpaceManager.OK, None
+        needed = format_bytes(estimate) if estimate else '未知'
+        if status == DiskSpaceManager.OK:
+            self.log(f'預留磁碟空間 {needed}（可用 {format_bytes(max(0, available))}）', 'debug')
+        elif status == DiskSpaceManager.WAIT:
+            self.log(f'磁碟空間已被其他工作預留（需要 {needed}，剩餘 {format_bytes(max(0, available))}），等待其他工作完成', 'info')
+            if job:
+                job.progress = '等待磁碟空間'
+        else:
+            self.log(f'磁碟空間不足，無法下載（需要 {needed}，可用 {format_bytes(max(0, available))}）: {url}', 'error')
+            if job:
+                job.progress = '磁碟空間不足'
+        return status, reservation
+
+    def reserve_render_space(self, output_path, nbytes):
+        """處理影片前預留輸出空間，空間不足時提示並回傳 None"""
+        try:
+            status, reservation, available = self.disk_space.reserve(
+                os.path.dirname(os.path.abspath(output_path)), nbytes, os.path.basename(output_path))
+        except OSError as e:
+            self.log(f'無法檢查磁碟空間，略過空間檢查: {e}', 'debug')
+            return DiskReservation(None, 0, output_path)
+        if status == DiskSpaceManager.OK:
+            self.log(f'預留磁碟空間 {format_bytes(nbytes)}（可用 {format_bytes(max(0, available))}）', 'debug')
+            return reservation
+        if status == DiskSpaceManager.WAIT:
+            message = f'目前進行中的工作完成後才有足夠空間（需要約 {format_bytes(nbytes)}），請稍後再試'
+        else:
+            message = f'磁碟空間不足（需要約 {format_bytes(nbytes)}，可用 {format_bytes(max(0, available))}）'
+        self.log(message, 'error')
+        QMessageBox.warning(self, '警告', message)
         return None
 
     def toggle_log_mode(self):
@@ -2024,10 +5667,11 @@ class YTDLPDownloader(QMainWindow):
         # 輸出格式選擇
         format_layout = QHBoxLayout()
         format_layout.addWidget(QLabel("輸出格式:"), 0)
-        self.format_combo = QComboBox()
-        self.format_combo.addItems(["MP4", "MP3"])
-        self.format_combo.currentTextChanged.connect(self.on_format_changed)
-        format_layout.addWidget(self.format_combo, 1)
+        # 剪輯的輸出格式與下載格式（format_combo，含 m4a/opus）分開，切換模式後兩邊不會互相覆蓋
+        self.output_format_combo = QComboBox()
+        self.output_format_combo.addItems(["MP4", "MP3"])
+        self.output_format_combo.currentTextChanged.connect(self.on_format_changed)
+        format_layout.addWidget(self.output_format_combo, 1)
 
         # 將音量、解析度和格式佈局加入一個新的主橫向佈局
         vol_res_format_layout = QHBoxLayout()
@@ -2411,7 +6055,7 @@ class YTDLPDownloader(QMainWindow):
                     url_raw = cmd[6:].strip()
                     url = extract_url(url_raw)
                     self.log(f'[後台] 接收到遠端下載指令: {url}', 'debug')
-                    threading.Thread(target=self.download_video, args=(url, 'mp4', '.'), daemon=True).start()
+                    self.enqueue_download(url, 'mp4', '.')
             except Exception as e:
                 break
         # 連接斷開後，關閉socket
@@ -2606,7 +6250,7 @@ class YTDLPDownloader(QMainWindow):
             QMessageBox.warning(self, '警告', '請先選擇要處理的影片')
             return
 
-        output_format = self.format_combo.currentText().lower()
+        output_format = self.output_format_combo.currentText().lower()
         
         # 檢查裁剪參數（僅在 MP4 格式時檢查）
         if output_format != 'mp3':
@@ -2692,11 +6336,20 @@ class YTDLPDownloader(QMainWindow):
 
                 ffmpeg_cmd.append(output_path)
 
+                # 合併使用直接複製，輸出大小約為所有輸入的總和
+                input_size = sum(os.path.getsize(path) for path in [main_video] + merge_videos if os.path.exists(path))
+                reservation = self.reserve_render_space(
+                    output_path, estimate_render_size(input_size, 0, 'mp4', False))
+                if reservation is None:
+                    os.remove(temp_list_path)
+                    return
+
                 self.log(f'開始合併影片...', 'info')
                 self.log(f'合併列表檔案: {temp_list_path}', 'debug')
                 self.log(f'執行命令: {" ".join(ffmpeg_cmd)}', 'debug')
 
                 def on_complete(path):
+                    self.disk_space.release(reservation)
                     # 在處理完成後清理臨時檔案
                     try:
                         if os.path.exists(temp_list_path):
@@ -2706,6 +6359,7 @@ class YTDLPDownloader(QMainWindow):
                     self.on_process_complete(path)
 
                 def on_error(msg):
+                    self.disk_space.release(reservation)
                     # 在處理失敗後清理臨時檔案
                     try:
                         if os.path.exists(temp_list_path):
@@ -2832,10 +6486,28 @@ class YTDLPDownloader(QMainWindow):
         
         ffmpeg_cmd.append(output_path)
 
+        # 依輸入大小與編碼設定預留輸出空間
+        input_path = self.video_path_input.text().strip()
+        input_size = os.path.getsize(input_path) if os.path.exists(input_path) else 0
+        duration = self.media_player.get_length() / 1000 if self.media_player and self.media_player.get_length() > 0 else 0
+        reencode = output_format == 'mp3' or '-filter_complex' in ffmpeg_cmd
+        reservation = self.reserve_render_space(
+            output_path, estimate_render_size(input_size, duration, output_format, reencode, start_time, end_time))
+        if reservation is None:
+            return
+
+        def on_complete(path):
+            self.disk_space.release(reservation)
+            self.on_process_complete(path)
+
+        def on_error(msg):
+            self.disk_space.release(reservation)
+            self.on_process_error(msg)
+
         # 執行 FFmpeg 命令
         threading.Thread(
             target=run_ffmpeg_command,
-            args=(ffmpeg_cmd, self.log, lambda path: self.on_process_complete(path), self.on_process_error),
+            args=(ffmpeg_cmd, self.log, on_complete, on_error),
             daemon=True
         ).start()
 
@@ -2969,6 +6641,14 @@ class YTDLPDownloader(QMainWindow):
                 # 如果 media_player 是 None，說明 VLC 未準備好，彈出警告框
                 QMessageBox.warning(self, '錯誤', 'VLC 播放器未準備好，無法載入影片。\n請確認 VLC 核心檔案已正確放置。')
                 self.log('VLC 播放器未準備好，無法載入影片。', 'error')
+        elif event.type() == ProbeResultEvent.EVENT_TYPE:
+            self.apply_probe_result(event)
+        elif event.type() == PlaylistEntriesEvent.EVENT_TYPE:
+            self.apply_playlist_entries(event)
+        elif event.type() == QueueJobEvent.EVENT_TYPE:
+            self.refresh_queue_row(event.job)
+        elif event.type() == QueueJobsEvent.EVENT_TYPE:
+            self.refresh_queue_rows(event.jobs)
         elif event.type() == ScreenshotCompleteEvent.EVENT_TYPE:
             QMessageBox.information(self, '操作完成', f'截圖已成功儲存至：{event.output_path}')
             self.log(f'截圖已儲存至：{event.output_path}', 'info')